@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+
+# Points shared by every patient: 0/0 as a starting point and 9.7/50, the P50 calculated from 19mmHg.
+# They are not stored with the data; the patient page shows them as the first two (virtual) measurements.
+ANCHOR_POINTS = np.array([[0.0, 0.0], [9.7, 50.0]], dtype=np.float32)
+N_ANCHORS = len(ANCHOR_POINTS)
+
+
+def with_anchor_rows(patient_data):
+    """
+    One patient's measurements with the anchor points prepended as unselected rows, indexed from 0.
+    The anchor rows copy the patient's first row, so the status columns read the same on every row.
+    """
+    anchors = patient_data.iloc[[0] * N_ANCHORS].copy()
+    anchors["Insp. O2 (%)"] = ANCHOR_POINTS[:, 0]
+    anchors["SpO2 (%)"] = ANCHOR_POINTS[:, 1]
+    anchors["selected_measurement"] = 0
+    return pd.concat([anchors, patient_data], ignore_index=True)
+
@@ -0,0 +1,24 @@
+import os
+import threading
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode="w", fsync=False, **open_kwargs):
+    """
+    Open a temporary file next to `path` and move it over `path` once the block completes, so readers
+    never see a half-written file. If the block fails, the temporary file is removed and `path` is untouched.
+    With fsync=True the data is flushed to disk before the file is moved into place.
+    """
+    # Unique per process and thread, so concurrent writers of the same path don't share a temporary file
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporary_path, mode, **open_kwargs) as file:
+            yield file
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
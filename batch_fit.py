@@ -0,0 +1,234 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from atomic_file import atomic_write
+from hill_equation import hill_eq, train_hill_model
+from patient_index import PatientIndex
+from schema import apply_schema
+from sigmoid import sigmoid, train_sigmoid_model
+
+# Patients per work unit; every finished chunk is written as its own part file
+CHUNK_SIZE = 200
+FORMATS = ["parquet", "csv"]
+HILL_PARAMS = ["L", "K", "n"]
+SIGMOID_PARAMS = ["L", "x0", "k", "b"]
+# Manifest entries that make a run a different job; the others describe its input
+JOB_SETTINGS = ["source", "chunk_size", "format"]
+
+
+def read_dataset(path):
+    """Measurements from a CSV, Parquet, Feather/Arrow or SQLite (storage.SqliteStorage) file."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return pd.read_csv(path)
+    if extension == ".parquet":
+        return pd.read_parquet(path)
+    if extension in (".feather", ".arrow"):
+        return pd.read_feather(path)
+    if extension in (".sqlite", ".db"):
+        from storage import SqliteStorage
+        return SqliteStorage(path).load_all()
+    raise ValueError(f"Unsupported input file: {path}")
+
+
+def read_from_storage(secrets_path):
+    # The storage backend configured for the app (Google Sheet or SQLite)
+    from storage import load_secrets, storage_from_secrets
+    return storage_from_secrets(load_secrets(secrets_path)).load_all()
+
+
+def patient_points(data):
+    """(patient_id, x, y) of the selected measurements of every patient, in Patient_ID order."""
+    data, _ = apply_schema(data)
+    data = data.sort_values(["Patient_ID", "Insp. O2 (%)"])
+    patient_index = PatientIndex(data)
+    x_all = data["Insp. O2 (%)"].to_numpy(dtype=float)
+    y_all = data["SpO2 (%)"].to_numpy(dtype=float)
+    selected = data["selected_measurement"].to_numpy() == 1
+
+    points = []
+    for patient_id, start, stop in patient_index.frame[["start", "stop"]].itertuples():
+        mask = selected[start:stop]
+        points.append((int(patient_id), x_all[start:stop][mask], y_all[start:stop][mask]))
+    return points
+
+
+def points_fingerprint(points):
+    """Hash of every patient's selected points, so a resumed run notices any change to the input."""
+    digest = hashlib.blake2b(digest_size=16)
+    for patient_id, x, y in points:
+        digest.update(patient_id.to_bytes(8, "little", signed=True))
+        digest.update(len(x).to_bytes(8, "little"))
+        digest.update(np.ascontiguousarray(x, dtype=np.float64).tobytes())
+        digest.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def fit_patient(patient_id, x, y):
+    if len(x) == 0:
+        return unfitted_record(patient_id, "no selected measurements")
+    record = {"Patient_ID": patient_id, "n_selected": len(x)}
+
+    started = time.perf_counter()
+    popt, info = train_hill_model(x, y, return_info=True)
+    record["hill_ms"] = (time.perf_counter() - started) * 1000
+    record["hill_converged"] = popt is not None
+    for name, value in zip(HILL_PARAMS, popt if popt is not None else [np.nan] * len(HILL_PARAMS)):
+        record[f"hill_{name}"] = float(value)
+    record["hill_mse"] = float(np.mean((y - hill_eq(x, *popt)) ** 2)) if popt is not None else np.nan
+    record["hill_nfev"] = info["nfev"] if popt is not None else 0
+    record["hill_error"] = info["error"] if popt is None else ""
+
+    started = time.perf_counter()
+    try:
+        popt, info = train_sigmoid_model(x, y, return_info=True)
+        error = ""
+    except Exception as e:
+        popt, info, error = None, None, str(e)
+    record["sigmoid_ms"] = (time.perf_counter() - started) * 1000
+    record["sigmoid_converged"] = popt is not None
+    for name, value in zip(SIGMOID_PARAMS, popt if popt is not None else [np.nan] * len(SIGMOID_PARAMS)):
+        record[f"sigmoid_{name}"] = float(value)
+    record["sigmoid_mse"] = float(np.mean((y - sigmoid(x, *popt)) ** 2)) if popt is not None else np.nan
+    record["sigmoid_nfev"] = info["nfev"] if popt is not None else 0
+    record["sigmoid_error"] = error
+    return record
+
+
+def unfitted_record(patient_id, error):
+    # Same columns as a fitted record, so the patient still gets a row in the results
+    record = {"Patient_ID": patient_id, "n_selected": 0}
+    for model, params in (("hill", HILL_PARAMS), ("sigmoid", SIGMOID_PARAMS)):
+        record[f"{model}_ms"] = 0.0
+        record[f"{model}_converged"] = False
+        for name in params:
+            record[f"{model}_{name}"] = np.nan
+        record[f"{model}_mse"] = np.nan
+        record[f"{model}_nfev"] = 0
+        record[f"{model}_error"] = error
+    return record
+
+
+def fit_chunk(chunk_id, patients):
+    # Runs in a worker process
+    warnings.filterwarnings("ignore")
+    return chunk_id, [fit_patient(patient_id, x, y) for patient_id, x, y in patients]
+
+
+def part_path(output_dir, chunk_id, file_format):
+    return os.path.join(output_dir, f"part-{chunk_id:05d}.{file_format}")
+
+
+def write_frame(frame, path, file_format):
+    # An interrupted run never leaves a half-written part behind
+    if file_format == "parquet":
+        with atomic_write(path, "wb") as part:
+            frame.to_parquet(part, index=False)
+    else:
+        with atomic_write(path, encoding="utf-8", newline="") as part:
+            frame.to_csv(part, index=False)
+
+
+def read_frame(path, file_format):
+    return pd.read_parquet(path) if file_format == "parquet" else pd.read_csv(path, keep_default_na=False, na_values=[""])
+
+
+def check_manifest(output_dir, manifest, restart):
+    """
+    Keep the parts of an earlier, interrupted run of the same job on the same input; start over when the input
+    changed since (patient count or fingerprint), and refuse to mix different jobs.
+    """
+    path = os.path.join(output_dir, "manifest.json")
+    if os.path.exists(path) and not restart:
+        with open(path, encoding="utf-8") as manifest_file:
+            previous = json.load(manifest_file)
+        if previous == manifest:
+            return
+        if any(previous.get(setting) != manifest[setting] for setting in JOB_SETTINGS):
+            raise SystemExit(f"{output_dir} holds results of a different run ({previous}); use --restart to discard them.")
+        print("The input changed since the earlier run; starting over", file=sys.stderr)
+    for part in glob.glob(os.path.join(output_dir, "part-*")):
+        os.remove(part)
+    with open(path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def run(points, output_dir, file_format, workers, chunk_size, source, restart=False):
+    os.makedirs(output_dir, exist_ok=True)
+    chunks = [points[i:i + chunk_size] for i in range(0, len(points), chunk_size)]
+    manifest = {
+        "source": source,
+        "patients": len(points),
+        "chunk_size": chunk_size,
+        "format": file_format,
+        "fingerprint": points_fingerprint(points),
+    }
+    check_manifest(output_dir, manifest, restart)
+
+    todo = [chunk_id for chunk_id in range(len(chunks)) if not os.path.exists(part_path(output_dir, chunk_id, file_format))]
+    if len(todo) < len(chunks):
+        print(f"Resuming: {len(chunks) - len(todo)} of {len(chunks)} chunks already done", file=sys.stderr)
+
+    started = time.perf_counter()
+    fitted = 0
+    total = sum(len(chunks[chunk_id]) for chunk_id in todo)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fit_chunk, chunk_id, chunks[chunk_id]) for chunk_id in todo]
+        for done, future in enumerate(as_completed(futures), start=1):
+            chunk_id, records = future.result()
+            write_frame(pd.DataFrame(records), part_path(output_dir, chunk_id, file_format), file_format)
+
+            fitted += len(chunks[chunk_id])
+            elapsed = time.perf_counter() - started
+            rate = fitted / elapsed if elapsed > 0 else 0.0
+            eta = (total - fitted) / rate if rate > 0 else 0.0
+            print(f"[{done}/{len(todo)} chunks] {fitted}/{total} patients, {rate:.0f} patients/s, ETA {eta:.0f} s", file=sys.stderr, flush=True)
+
+    # Combine the parts into one file, in Patient_ID order
+    parts = [read_frame(part_path(output_dir, chunk_id, file_format), file_format) for chunk_id in range(len(chunks))]
+    results = pd.concat(parts, ignore_index=True).sort_values("Patient_ID") if parts else pd.DataFrame()
+    results_path = os.path.join(output_dir, f"results.{file_format}")
+    write_frame(results, results_path, file_format)
+    return results_path, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the Hill and sigmoid models for every patient, without Streamlit.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="measurements file (.csv, .parquet, .feather/.arrow or .sqlite)")
+    source.add_argument("--secrets", help="Streamlit secrets file; read the data from the storage backend configured there")
+    parser.add_argument("--output-dir", default="fit_results", help="directory for the part files and the combined results")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="patients per part file")
+    parser.add_argument("--restart", action="store_true", help="discard the parts of an earlier run instead of resuming it")
+    args = parser.parse_args(argv)
+
+    data = read_dataset(args.input) if args.input else read_from_storage(args.secrets)
+    points = patient_points(data)
+    print(f"Fitting {len(points)} patients with {args.workers} worker(s)", file=sys.stderr)
+
+    results_path, results = run(
+        points, args.output_dir, args.format, args.workers, args.chunk_size,
+        source=os.path.abspath(args.input) if args.input else "storage", restart=args.restart,
+    )
+    if results.empty:
+        print(f"Wrote {results_path}: no patients in the input")
+        return 0
+    print(
+        f"Wrote {len(results)} patients to {results_path} "
+        f"(Hill converged: {int(results['hill_converged'].sum())}, sigmoid converged: {int(results['sigmoid_converged'].sum())})"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
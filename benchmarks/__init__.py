@@ -0,0 +1,7 @@
+"""
+Benchmarks for the data and fitting stages of the app on synthetic cohorts, runnable without
+a Streamlit server or network access. Converged batch Hill fits are also checked against curve_fit:
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --baseline results.json --threshold 0.25
+"""
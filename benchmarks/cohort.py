@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+# Cohort sizes used by the benchmark runner
+COHORT_SIZES = [200, 2_000, 20_000]
+
+
+def synthetic_cohort(n_patients, seed=0, outlier_rate=0.05):
+    """
+    Deterministic cohort of Hill-shaped SpO2 vs Insp. O2 curves, shaped like the frame storage.load_all()
+    returns (one row per measurement, status flags on one row per patient).
+
+    Every patient gets 3-8 measurements between 10% and 21% Insp. O2 from a Hill curve with its own
+    L, K and n, plus Gaussian noise; `outlier_rate` of the points are replaced by random SpO2 values
+    and most of those are deselected, as a labeller would.
+    """
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(3, 9, n_patients)
+    patient_ids = np.repeat(np.arange(1, n_patients + 1), counts)
+    n_rows = len(patient_ids)
+
+    # Per-patient curve parameters, repeated onto their measurements
+    L = np.repeat(rng.uniform(94, 99.5, n_patients), counts)
+    K = np.repeat(rng.uniform(11, 19, n_patients), counts)
+    n = np.repeat(rng.uniform(1.5, 7, n_patients), counts)
+
+    insp_o2 = np.round(rng.uniform(10, 21, n_rows), 1)
+    spo2 = L * insp_o2 ** n / (K ** n + insp_o2 ** n) + rng.normal(0, 1.0, n_rows)
+    outliers = rng.random(n_rows) < outlier_rate
+    spo2[outliers] = rng.uniform(60, 100, outliers.sum())
+    spo2 = np.round(np.clip(spo2, 0, 100), 1)
+
+    selected = np.where(outliers & (rng.random(n_rows) < 0.7), 0, 1)
+
+    # Status flags go on the patient's row with the lowest Insp. O2, which is the row the app reads them
+    # from (after sorting by Patient_ID and Insp. O2) and writes them to
+    order = np.lexsort((insp_o2, patient_ids))
+    flag_row = np.zeros(n_rows, dtype=bool)
+    flag_row[order[np.r_[True, patient_ids[order][1:] != patient_ids[order][:-1]]]] = True
+    flags = {
+        column: np.where(flag_row, np.repeat((rng.random(n_patients) < rate).astype(int), counts), 0)
+        for column, rate in [("is_ideal", 0.2), ("is_processed", 0.5), ("is_problematic", 0.1)]
+    }
+
+    return pd.DataFrame({
+        "Patient_ID": patient_ids,
+        "Insp. O2 (%)": insp_o2,
+        "SpO2 (%)": spo2,
+        "selected_measurement": selected,
+        "Remarks": "",
+        **flags,
+        "comment": "",
+    })
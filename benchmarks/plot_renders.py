@@ -0,0 +1,91 @@
+import argparse
+import gc
+import io
+import json
+import resource
+import sys
+import time
+import warnings
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from benchmarks.cohort import synthetic_cohort
+from benchmarks.runner import prepare, selected_points
+from hill_equation import plot_hill_fit, train_hill_model
+
+# Memory is sampled every this many renders
+SAMPLE_EVERY = 100
+
+
+def render_jobs(n_patients, seed=0):
+    # Selected points and Hill parameters of synthetic patients, with the rest of each patient as deselected points
+    data, patient_index = prepare(synthetic_cohort(n_patients, seed=seed))
+    jobs = []
+    for (x, y), pid in zip(selected_points(data, patient_index, patient_index.frame.index), patient_index.frame.index):
+        rows = patient_index.rows(data, pid)
+        deselected = rows[rows["selected_measurement"] == 0]
+        popt = train_hill_model(x, y) if len(x) >= 3 else None
+        if popt is None:
+            continue
+        jobs.append((x, y, popt, {
+            "Insp. O2 (%)": deselected["Insp. O2 (%)"].to_numpy(),
+            "SpO2 (%)": deselected["SpO2 (%)"].to_numpy(),
+            "Measurement Nr": np.arange(len(deselected)) + 3,
+        }, np.arange(len(x)) + 3))
+    return jobs
+
+
+def peak_rss_kb():
+    # Peak resident set size of this process (KB on Linux); it only grows, so it shows memory that is never released
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(renders, dpi=100):
+    """Render `renders` Hill plots to PNG, as the gallery does, tracking time and memory growth."""
+    jobs = render_jobs(200)
+    times = []
+    samples = []
+    gc.collect()
+    baseline = peak_rss_kb()
+    for i in range(renders):
+        x, y, popt, deselected, numbers = jobs[i % len(jobs)]
+        started = time.perf_counter()
+        fig, _ = plot_hill_fit(x, y, popt, deselected, numbers)
+        fig.savefig(io.BytesIO(), format="png", dpi=dpi)
+        del fig
+        times.append(time.perf_counter() - started)
+        if (i + 1) % SAMPLE_EVERY == 0:
+            samples.append({"renders": i + 1, "rss_growth_kb": peak_rss_kb() - baseline, "open_pyplot_figures": len(plt.get_fignums())})
+    return {
+        "renders": renders,
+        "ms_per_plot_median": float(np.median(times) * 1000),
+        "ms_per_plot_mean": float(np.mean(times) * 1000),
+        "memory_growth_kb": peak_rss_kb() - baseline,
+        "open_pyplot_figures": len(plt.get_fignums()),
+        "samples": samples,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.plot_renders", description="Render time and memory growth of repeated Hill plots.")
+    parser.add_argument("--renders", type=int, default=1000)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    result = run(args.renders)
+    for sample in result["samples"]:
+        print(f"{sample['renders']:>6} renders  {sample['rss_growth_kb']:10.0f} KB more peak RSS  {sample['open_pyplot_figures']:>5} open pyplot figures")
+    print(f"{result['ms_per_plot_median']:.1f} ms per plot (median), {result['memory_growth_kb']:.0f} KB peak RSS growth over {args.renders} renders")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(result, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
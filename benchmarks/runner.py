@@ -0,0 +1,221 @@
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+
+import matplotlib
+
+# Render off-screen; the benchmarks never start a Streamlit server or touch the network
+matplotlib.use("Agg")
+import numpy as np
+
+from anchor_points import with_anchor_rows
+from benchmarks.cohort import COHORT_SIZES, synthetic_cohort
+from fit_cache import fit_cache
+from hill_equation import fit_hill_patients, hill_eq, plot_hill_fit, train_hill_model
+from patient_index import PatientIndex, patient_arrays
+from schema import apply_schema
+from sigmoid import train_sigmoid_model
+
+# A stage fails the regression check when it is this much slower than in the baseline
+DEFAULT_THRESHOLD = 0.25
+# Stages faster than this are too noisy to compare
+MIN_SECONDS = 0.005
+FILTERS = ["ideal", "processed", "problematic", "unprocessed"]
+# A converged batch fit may have at most this much (relative) higher MSE than curve_fit
+BATCH_FIT_TOLERANCE = 0.01
+
+
+def prepare(raw):
+    # The app's load path: typed schema, one sort, patient index
+    data, _ = apply_schema(raw)
+    data = data.sort_values(["Patient_ID", "Insp. O2 (%)"])
+    return data, PatientIndex(data)
+
+
+def selected_points(data, patient_index, patient_ids):
+    points = []
+    for pid in patient_ids:
+        rows = patient_index.rows(data, pid)
+        rows = rows[rows["selected_measurement"] == 1]
+        points.append((rows["Insp. O2 (%)"].to_numpy(dtype=float), rows["SpO2 (%)"].to_numpy(dtype=float)))
+    return points
+
+
+def build_stages(raw, fit_sample, plot_sample):
+    """Stage name -> zero-argument callable, for one cohort."""
+    data, patient_index = prepare(raw)
+    sample_ids = patient_index.frame.index.to_numpy()[:fit_sample]
+    points = selected_points(data, patient_index, sample_ids)
+    plot_points = [(x, y) for x, y in points[:plot_sample] if len(x) >= 3]
+    plot_params = [train_hill_model(x, y) for x, y in plot_points]
+
+    def sidebar_filters():
+        # Every combination of the four sidebar checkboxes
+        for mask in range(2 ** len(FILTERS)):
+            selected = {name: bool(mask & (1 << i)) for i, name in enumerate(FILTERS)}
+            patient_index.filter_ids(**selected)
+
+    def anchor_rows():
+        for pid in sample_ids:
+            with_anchor_rows(patient_index.rows(data, pid))
+
+    def per_patient_fits(train):
+        def run():
+            fit_cache.clear()
+            for x, y in points:
+                if len(x) < 4:
+                    continue
+                try:
+                    train(x, y)
+                except Exception:
+                    pass
+        return run
+
+    def plots():
+        for (x, y), popt in zip(plot_points, plot_params):
+            if popt is None:
+                continue
+            fig, _ = plot_hill_fit(x, y, popt)
+            fig.savefig(io.BytesIO(), format="png", dpi=150)
+
+    return {
+        "apply_schema": lambda: apply_schema(raw),
+        "patient_index": lambda: prepare(raw),
+        "sidebar_filters": sidebar_filters,
+        "anchor_rows": anchor_rows,
+        "gallery_arrays": lambda: patient_arrays(data, patient_index, patient_index.frame.index),
+        "fit_hill_batch": lambda: fit_hill_patients(data),
+        "train_hill_model": per_patient_fits(train_hill_model),
+        "train_sigmoid_model": per_patient_fits(train_sigmoid_model),
+        "plot_hill_fit": plots,
+    }
+
+
+def measure(stage, repeat):
+    """Best wall time over `repeat` runs, and the peak traced allocation of one extra run."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(times), "mean_seconds": float(np.mean(times)), "peak_kb": peak / 1024}
+
+
+def run(sizes, repeat, fit_sample, plot_sample, only=None, seed=0):
+    results = {}
+    for size in sizes:
+        raw = synthetic_cohort(size, seed=seed)
+        stages = build_stages(raw, fit_sample, plot_sample)
+        results[str(size)] = {}
+        for name, stage in stages.items():
+            if only and name not in only:
+                continue
+            results[str(size)][name] = measure(stage, repeat)
+            print(f"{size:>6} patients  {name:<20} {results[str(size)][name]['seconds'] * 1000:10.1f} ms  "
+                  f"{results[str(size)][name]['peak_kb']:10.0f} KB peak", flush=True)
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "fit_sample": fit_sample,
+            "plot_sample": plot_sample,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def batch_fit_mismatches(raw, sample, tolerance=BATCH_FIT_TOLERANCE):
+    """
+    Patients among the first `sample` whose batch Hill fit claims convergence but ends with a higher MSE
+    than curve_fit (train_hill_model) with the same bounds, as (patient_id, batch MSE, curve_fit MSE).
+    """
+    data, patient_index = prepare(raw)
+    batch = fit_hill_patients(data)
+    sample_ids = patient_index.frame.index.to_numpy()[:sample]
+    mismatches = []
+    for pid, (x, y) in zip(sample_ids, selected_points(data, patient_index, sample_ids)):
+        if not batch.at[pid, "converged"]:
+            continue
+        popt = train_hill_model(x, y)
+        if popt is None:
+            continue
+        reference = float(np.mean((y - hill_eq(x, *popt)) ** 2))
+        if batch.at[pid, "mse"] > reference * (1 + tolerance) + 1e-9:
+            mismatches.append((int(pid), float(batch.at[pid, "mse"]), reference))
+    return mismatches
+
+
+def regressions(report, baseline, threshold=DEFAULT_THRESHOLD, min_seconds=MIN_SECONDS):
+    """Stages that got more than `threshold` slower than in `baseline` (both as returned by run)."""
+    slower = []
+    for size, stages in report["results"].items():
+        for name, result in stages.items():
+            before = baseline["results"].get(size, {}).get(name)
+            if before is None or max(before["seconds"], result["seconds"]) < min_seconds:
+                continue
+            if result["seconds"] > before["seconds"] * (1 + threshold):
+                slower.append((size, name, before["seconds"], result["seconds"]))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Time the data and fitting stages on synthetic cohorts.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=COHORT_SIZES, help="cohort sizes in patients")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (the best one is reported)")
+    parser.add_argument("--fit-sample", type=int, default=200, help="patients fitted one by one in the per-patient fit stages")
+    parser.add_argument("--plot-sample", type=int, default=20, help="patients rendered in the plot stage")
+    parser.add_argument("--stages", nargs="+", help="only run these stages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown against the baseline, e.g. 0.25 for 25%%")
+    parser.add_argument("--check-sample", type=int, default=500, help="patients whose batch Hill fit is checked against curve_fit (0 to skip)")
+    args = parser.parse_args(argv)
+
+    # Fits that hit a bound or can't estimate the covariance warn a lot; that is expected here
+    warnings.filterwarnings("ignore")
+    report = run(args.sizes, args.repeat, args.fit_sample, args.plot_sample, args.stages, args.seed)
+
+    failed = False
+    if args.check_sample:
+        for size in args.sizes:
+            mismatches = batch_fit_mismatches(synthetic_cohort(size, seed=args.seed), args.check_sample)
+            for pid, batch_mse, reference in mismatches:
+                print(f"BATCH FIT {size} patients, patient {pid}: converged with MSE {batch_mse:.4f}, curve_fit reaches {reference:.4f}")
+            failed |= bool(mismatches)
+        if not failed:
+            print(f"Converged batch Hill fits are within {BATCH_FIT_TOLERANCE:.0%} of curve_fit")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        slower = regressions(report, baseline, args.threshold)
+        for size, name, before, after in slower:
+            print(f"REGRESSION {size} patients {name}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+        if slower:
+            return 1
+        print(f"No stage is more than {args.threshold:.0%} slower than {args.baseline}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
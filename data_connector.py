@@ -1,163 +1,153 @@
 import streamlit as st
-import pandas as pd
+import os
 import time
-from google_sheets import GoogleSheetsManager
-
-
+import uuid
+from anchor_points import N_ANCHORS
+from google_sheets import pool_stats
+from patient_index import PatientIndex
+from schema import apply_schema
+from shared_dataset import SharedDataset
+from storage import create_storage
+from thumbnail_cache import thumbnail_cache
+from tracing import traced
+from write_behind import WriteBehindQueue
+
+# Save in the background instead of blocking the page on network writes
+WRITE_BEHIND = True
+JOURNAL_PATH = os.path.join(".journal", "sheet_writes.jsonl")
+
+
+@traced()
 def load_all():
-    if "data" not in st.session_state:
-        st.session_state.data, st.session_state.patient_ids = load_data()
-    
-    # Now use st.session_state.data throughout
-    data = st.session_state.data
-
-    data["Patient_ID"] = pd.to_numeric(data["Patient_ID"], errors="coerce")
-    data = data.dropna(subset=["Patient_ID"])
-
-    patient_ids = st.session_state.patient_ids
-
-    if "problematic_patients" not in st.session_state:
-        st.session_state.problematic_patients = load_problematic_patients(data)
-    
-    # Now use st.session_state.data throughout
-    problematic_patients = st.session_state.problematic_patients
-
-    if "ideal_patients" not in st.session_state:
-        st.session_state.ideal_patients = load_ideal_patients(data)
-
-    ideal_patients = st.session_state.ideal_patients
-
-    if "unprocessed_patients" not in st.session_state:
-        st.session_state.unprocessed_patients = load_unprocessed_patients(data)
-
-    unprocessed_patients = st.session_state.unprocessed_patients
-
-    return data, problematic_patients, ideal_patients, unprocessed_patients, patient_ids
-
+    """The shared dataset's data and patient IDs; the data is shared by all sessions and must not be modified."""
+    dataset = get_dataset()
+    if "session_token" not in st.session_state:
+        st.session_state.session_token = uuid.uuid4().hex
+        st.session_state.dataset_version = dataset.version
+        report = dataset.load_report
+        st.toast(
+            f"Loaded {report['rows']} rows from the {report['source']} in {report['seconds']:.2f} s "
+            f"({report['memory_before'] / 1024:.0f} KB as loaded, {report['memory_after'] / 1024:.0f} KB typed)"
+        )
+        for error in report["errors"]:
+            st.warning(f"Data check: {error}")
+    elif st.session_state.dataset_version != dataset.version:
+        # Let the user know when patients were saved from another session since the last rerun
+        changed = dataset.changes_since(st.session_state.dataset_version, st.session_state.session_token)
+        if changed:
+            st.toast(f"Patient(s) {', '.join(str(pid) for pid in changed)} were updated in another session.", icon="🔄")
+        st.session_state.dataset_version = dataset.version
+
+    return dataset.data, dataset.patient_ids
+
+@st.cache_resource(show_spinner="Loading patient data...")
+def get_dataset():
+    # One copy of the data per server process, shared by every session
+    data, patient_ids, patient_index, load_report = load_data()
+    dataset = SharedDataset(data, patient_ids, patient_index, load_report)
+    if WRITE_BEHIND:
+        # Saves still waiting to be written are not in the loaded data yet
+        for labels in get_write_queue().pending_labels():
+            dataset.apply_labels(labels)
+    return dataset
+
+@st.cache_resource
+def get_storage():
+    # Backend chosen by the optional [storage] section of the secrets; the Google Sheet by default
+    config = dict(st.secrets.get("storage", {}))
+    secrets = dict(st.secrets.get("connections", {}).get("gsheets", {}))
+    return create_storage(config, secrets)
+
+@traced()
 def load_data():
-    secrets = st.secrets["connections"]["gsheets"]
-    sheet_manager = GoogleSheetsManager(secrets)
-    sheet = sheet_manager.get_sheet("anonymized_219")
-    data = pd.DataFrame(sheet.get_all_records())
+    storage = get_storage()
+    started = time.perf_counter()
+    data = storage.load_all()
+    load_report = {"source": storage.last_load_source, "rows": len(data), "seconds": time.perf_counter() - started}
+
+    # Cast to the compact column types once; nothing downstream converts types again
+    data, schema_report = apply_schema(data)
+    load_report.update(schema_report)
     patient_ids = data["Patient_ID"].unique()
-    
-    data = add_zero_and_p50(data)
- 
-    return data, patient_ids
-
-def load_problematic_patients(data):
-    first_measurements = data.sort_values(["Patient_ID", "Insp. O2 (%)"]).groupby("Patient_ID").head(1)
-    # Identify patients where the first measurement has is_problematic = 1
-    problematic_patient_ids = first_measurements[first_measurements["is_problematic"] == 1]["Patient_ID"].unique()
-
-    # Filter all measurements for those patients
-    problematic_patients = data[data["Patient_ID"].isin(problematic_patient_ids)]
-    return problematic_patients
-
-def load_ideal_patients(data):
-    # Identify patients where the first measurement has is_ideal = 1
-    first_measurements = data.sort_values(["Patient_ID", "Insp. O2 (%)"]).groupby("Patient_ID").head(1)
-    ideal_patient_ids = first_measurements[first_measurements["is_ideal"] == 1]["Patient_ID"].unique()
-
-    # Filter all measurements for those patients
-    ideal_patients = data[data["Patient_ID"].isin(ideal_patient_ids)]
-    return ideal_patients
-
-def load_unprocessed_patients(data):
-    # Identify first measurements for each patient
-    first_measurements = (
-        data.sort_values(["Patient_ID", "Insp. O2 (%)"])
-            .groupby("Patient_ID")
-            .head(1)
-    )
-    
-    # Get IDs of patients whose first measurement is unprocessed
-    unprocessed_patient_ids = first_measurements[
-        first_measurements["is_processed"] != 1
-    ]["Patient_ID"].unique()
-
-    # Filter and return all rows for these unprocessed patients
-    unprocessed_patients = data[data["Patient_ID"].isin(unprocessed_patient_ids)]
-    return unprocessed_patients
 
+    # Sort once and summarize every patient; the 0/0 and P50 anchor points are not added to the data
+    data = data.sort_values(["Patient_ID", "Insp. O2 (%)"])
+    patient_index = PatientIndex(data)
+
+    return data, patient_ids, patient_index, load_report
+
+@st.cache_resource
+def get_write_queue():
+    # One queue per server process; creating it replays saves that were not written before a restart
+    return WriteBehindQueue(JOURNAL_PATH, get_storage().write_patient_labels)
+
+
+def render_sheet_status():
+    if WRITE_BEHIND:
+        status = get_write_queue().status()
+        if status["pending"]:
+            st.info(f"⏳ {status['pending']} patient(s) waiting to be saved.")
+        for patient_id, error in status["failed"].items():
+            st.error(f"Saving patient {patient_id} failed, retrying: {error}")
+        last_write, totals = status["last_write"], status["totals"]
+        if last_write:
+            st.caption(
+                f"Last save written: patient {last_write['patient_id']}, {last_write['cells']} cells in "
+                f"{last_write['requests']} request(s), {last_write['latency']:.2f} s; "
+                f"{totals['writes']} save(s) in {totals['requests']} request(s), "
+                f"{totals['latency'] / totals['writes']:.2f} s on average"
+            )
+
+    if st.button("🔄 Reload data", help="Load the data again, e.g. after the sheet was edited directly"):
+        # Every session picks up the reloaded data on its next rerun
+        get_dataset.clear()
+        st.rerun()
 
-def add_zero_and_p50(data):
-    # Store original indices
-    original_indices = data.index
-
-    # Identify first measurement for each patient
-    first_rows = data.sort_values(["Patient_ID", "Insp. O2 (%)"]).groupby("Patient_ID").head(1).copy()
-
-    # Create duplicates without modifying original data indices
-    duplicated_first_rows_0 = first_rows.copy()
-    duplicated_first_rows_p50 = first_rows.copy()
-
-    # Modify first duplicate for 0/0
-    duplicated_first_rows_0["Insp. O2 (%)"] = 0
-    duplicated_first_rows_0["SpO2 (%)"] = 0
-    duplicated_first_rows_0["selected_measurement"] = 0
-    duplicated_first_rows_0.index = range(len(data), len(data) + len(duplicated_first_rows_0))
-
-    # Modify second duplicate for P50
-    duplicated_first_rows_p50["Insp. O2 (%)"] = 9.7
-    duplicated_first_rows_p50["SpO2 (%)"] = 50
-    duplicated_first_rows_p50["selected_measurement"] = 0
-    duplicated_first_rows_p50.index = range(len(data) + len(duplicated_first_rows_0), 
-                                            len(data) + len(duplicated_first_rows_0) + len(duplicated_first_rows_p50))
-
-    # Concatenate modified rows back with the original data
-    data = pd.concat([data, duplicated_first_rows_0, duplicated_first_rows_p50], ignore_index=False)
-
-    # Sort to make sure the added rows appear first for each patient
-    data = data.sort_values(["Patient_ID", "Insp. O2 (%)"], ascending=[True, True])
-
-    return data
+    client_stats = pool_stats()
+    st.caption(
+        f"Sheets client: {client_stats['auth']} authorization(s), "
+        f"{client_stats['open_by_name']} name lookup(s), {client_stats['open_by_key']} open(s) by key"
+    )
 
 
+@traced()
 def save_data(data, patient_id):
     try:
-        # Filter data for the current patient
-        patient_rows = data[data["Patient_ID"] == patient_id].index + 2  # Rows in the Google Sheet (1-based index, with header)
-        patient_rows = patient_rows[2:]
-
-        relevant_measurements = st.session_state.selected_measurements[2:]
-        # Prepare updates for selected_measurement, is_ideal, and is_processed
-        updates = []
-        for i, row in enumerate(patient_rows):
-            # Update "selected_measurement" for each measurement of the patient
-            updates.append((row, 5, int(relevant_measurements[i])))
-
-        # Update "is_ideal" and "is_processed" (only for the first row of this patient in Google Sheets)
-        updates.append((patient_rows[0], 7, int(st.session_state.ideal_curve_checkbox)))  # First row for is_ideal
-        updates.append((patient_rows[0], 8, int(st.session_state.is_processed_toggle)))  # First row for is_processed
-        updates.append((patient_rows[0], 9, int(st.session_state.is_problematic_checkbox)))  # First row for is_problematic
-        updates.append((patient_rows[0], 10, st.session_state.txt)) 
-
-        secrets = st.secrets["connections"]["gsheets"]
-        sheet_manager = GoogleSheetsManager(secrets)
-        sheet = sheet_manager.get_sheet("anonymized_219")
-
-        # Batch update the Google Sheet
-        sheet_manager.update_multiple_cells(sheet, updates)
-
-        data.loc[patient_rows, "selected_measurement"] = relevant_measurements
-        data.loc[patient_rows[0], "is_ideal"] = int(st.session_state.ideal_curve_checkbox)
-        data.loc[patient_rows[0], "is_processed"] = int(st.session_state.is_processed_toggle)
-        data.loc[patient_rows[0], "is_problematic"] = int(st.session_state.is_problematic_checkbox)
-        data.loc[patient_rows[0], "comment"] = st.session_state.txt
-
-        # Update session state immediately after saving to Google Sheets
-        st.session_state.data.loc[data["Patient_ID"] == patient_id, "is_ideal"] = int(st.session_state.ideal_curve_checkbox)
-        st.session_state.data.loc[data["Patient_ID"] == patient_id, "is_processed"] = int(st.session_state.is_processed_toggle)
-        st.session_state.data.loc[data["Patient_ID"] == patient_id, "is_problematic"] = int(st.session_state.is_problematic_checkbox)
-        st.session_state.data.loc[data["Patient_ID"] == patient_id, "comment"] = st.session_state.txt
+        # Rows of the current patient; the table starts with the virtual anchor rows, which are never saved
+        row_ids = get_dataset().patient_index.rows(data, patient_id).index
+        relevant_measurements = st.session_state.selected_measurements[N_ANCHORS:]
+
+        labels = {
+            "patient_id": int(patient_id),
+            "row_ids": [int(row_id) for row_id in row_ids],
+            "selected_measurement": [int(selected) for selected in relevant_measurements],
+            "is_ideal": int(st.session_state.ideal_curve_checkbox),
+            "is_processed": int(st.session_state.is_processed_toggle),
+            "is_problematic": int(st.session_state.is_problematic_checkbox),
+            "comment": st.session_state.txt,
+        }
+
+        if WRITE_BEHIND:
+            # Journal the save and let the background writer send it to storage
+            get_write_queue().enqueue(labels)
+            st.session_state.dataset_version = get_dataset().apply_labels(labels, st.session_state.session_token)
+            # The patient's gallery thumbnails show the old selection
+            thumbnail_cache.invalidate_patient(labels["patient_id"])
+            st.toast("Patient data saved! Writing it to storage in the background.", icon='😍')
+            return
+
+        # Write the patient's labels in a single batch (one Sheets request or one SQLite transaction)
+        write_stats = get_storage().write_patient_labels(labels)
+
+        # Update the shared data immediately after saving
+        st.session_state.dataset_version = get_dataset().apply_labels(labels, st.session_state.session_token)
+        thumbnail_cache.invalidate_patient(labels["patient_id"])
 
         st.toast("Patient data saved successfully!", icon='😍')
-        st.success("Patient data saved successfully!")
-        time.sleep(2)
-        st.rerun()
-        
+        st.success(
+            f"Patient data saved successfully! ({write_stats['cells']} cells in "
+            f"{write_stats['requests']} request(s), {write_stats['latency']:.2f} s)"
+        )
         
     except Exception as e:
         st.error(f"Error saving patient data: {e}")
-
@@ -0,0 +1,63 @@
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+# Bounded LRU cache of fitted model parameters.
+# A single instance lives at module level, so every Streamlit session in the process shares it.
+class FitCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name, x_data, y_data, settings):
+        # Hash the selected points together with their lengths so different splits never collide
+        digest = hashlib.blake2b(digest_size=16)
+        for values in (x_data, y_data):
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            digest.update(len(values).to_bytes(8, "little"))
+            digest.update(values.tobytes())
+        return model_name, digest.hexdigest(), repr(settings)
+
+    def get_or_fit(self, model_name, x_data, y_data, settings, fit):
+        """
+        Return (result, cached) for these points and settings, running `fit()` on a miss.
+        Callers get their own copy of the result, so mutating it never changes the cache.
+        """
+        key = self.make_key(model_name, x_data, y_data, settings)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._entries[key]), True
+            self.misses += 1
+
+        # Fit outside the lock so slow fits don't block other sessions
+        result = fit()
+        # Failed fits are not cached so they are retried next time
+        if result is not None:
+            with self._lock:
+                self._entries[key] = copy.deepcopy(result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+fit_cache = FitCache()
@@ -0,0 +1,334 @@
+import importlib.machinery
+import os
+import multiprocessing
+import sys
+import threading
+import types
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, BrokenExecutor, as_completed
+import numpy as np
+import streamlit as st
+from gallery_worker import THUMBNAIL_DPI, fit_and_render_patient, init_worker
+from hill_equation import fit_hill_batch
+from pagination import page_number_input
+from patient_index import patient_arrays
+from plotting import PLOT_STYLE_VERSION
+from thumbnail_cache import thumbnail_cache, read_png_metadata
+from tracing import traced
+
+# One worker per core unless configured otherwise on the page
+DEFAULT_WORKERS = os.cpu_count() or 1
+PAGE_SIZES = [10, 25, 50, 100]
+DEFAULT_PAGE_SIZE = 25
+# Sort orders offered on the gallery pages, by column of the batch Hill fit (None: by patient ID)
+SORT_ORDERS = {"Patient ID": None, "MSE": "mse", "Hill n": "n"}
+
+# Jobs submitted ahead of time for the next gallery page, by thumbnail key
+_prefetching = {}
+_prefetch_lock = threading.Lock()
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+_main_lock = threading.Lock()
+_STAND_IN_MAIN = types.ModuleType("__main__")
+_STAND_IN_MAIN.__spec__ = importlib.machinery.ModuleSpec("__main__", None)
+
+
+def _start_method():
+    # Workers are started from the single-threaded forkserver rather than forked from the multi-threaded server,
+    # where a lock held by another thread (e.g. the fit cache's) would stay locked in the worker for good
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["gallery_worker"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def get_executor(max_workers):
+    """
+    The process pool shared by all sessions, kept alive across reruns so worker start-up and their fit caches are reused.
+    Only one pool exists at a time: asking for a different worker count shuts the old one down once the jobs
+    other sessions already gave it are done, without cancelling them.
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is not None and _executor_workers != max_workers:
+            _executor.shutdown(wait=False)
+            _executor = None
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=_start_method(), initializer=init_worker)
+            _executor_workers = max_workers
+        return _executor
+
+
+def discard_executor(executor):
+    # A worker died and the pool is broken; shut it down so the next get_executor starts a fresh one
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+@contextmanager
+def _stand_in_main():
+    # Streamlit installs the running page as __main__, known only by its __file__, and multiprocessing re-runs
+    # that file in every worker it starts. A __main__ known by the name "__main__" is skipped instead.
+    with _main_lock:
+        page_main = sys.modules["__main__"]
+        sys.modules["__main__"] = _STAND_IN_MAIN
+        try:
+            yield
+        finally:
+            # Unless a new script run has installed its own page in the meantime
+            if sys.modules["__main__"] is _STAND_IN_MAIN:
+                sys.modules["__main__"] = page_main
+
+
+def submit(executor, job):
+    # Workers are started on demand by submit, so every submit goes through the stand-in __main__
+    with _stand_in_main():
+        return executor.submit(fit_and_render_patient, job)
+
+
+def worker_count_input():
+    return int(st.sidebar.number_input(
+        "Worker processes",
+        min_value=1,
+        max_value=max(DEFAULT_WORKERS, 1),
+        value=DEFAULT_WORKERS,
+        help="Number of processes used to fit and render the patient plots in parallel.",
+    ))
+
+
+def thumbnail_key(job):
+    # Everything the rendered plot depends on
+    deselected = job["deselected_data"]
+    return thumbnail_cache.make_key(
+        job["patient_id"],
+        "hill",
+        [job["x_selected"], job["y_selected"], job["measurement_numbers_selected"],
+         deselected["Insp. O2 (%)"], deselected["SpO2 (%)"], deselected["Measurement Nr"]],
+        job.get("popt"),
+        (PLOT_STYLE_VERSION, THUMBNAIL_DPI),
+    )
+
+
+def cached_thumbnail(job, key):
+    """The cached result for a job, in the shape fit_and_render_patient returns, or None."""
+    png = thumbnail_cache.get(job["patient_id"], key)
+    metadata = read_png_metadata(png) if png is not None else None
+    if metadata is None:
+        return None
+    return {"patient_id": job["patient_id"], "popt": metadata["popt"], "mse": metadata["mse"], "png": png, "error": None}
+
+
+def show_result(job, result, slot):
+    with slot.container():
+        if result["error"]:
+            st.error(f"Error fitting Hill for Patient ID {job['patient_id']}: {result['error']}")
+        else:
+            st.write(job["caption"].format(patient_id=job["patient_id"], mse=result["mse"]))
+            st.image(result["png"])
+
+
+@traced()
+def render_gallery(jobs, n_columns, max_workers=DEFAULT_WORKERS):
+    """
+    Fit and render all jobs on a process pool and lay the plots into an n-column grid.
+    Grid slots are reserved in patient order up front, so each plot lands in its place as soon as it completes.
+    A failing patient only shows an error in its own slot.
+    Plots found in the thumbnail cache are shown straight away; only the others go to the pool.
+    """
+    slots = []
+    for start in range(0, len(jobs), n_columns):
+        columns = st.columns(n_columns)
+        for column in columns[:len(jobs) - start]:
+            slots.append(column.empty())
+
+    pending = []
+    futures = {}
+    for job, slot in zip(jobs, slots):
+        key = thumbnail_key(job)
+        result = cached_thumbnail(job, key)
+        if result is not None:
+            show_result(job, result, slot)
+            continue
+        # A job prefetched by an earlier run may still be in progress; wait for it instead of rendering twice
+        with _prefetch_lock:
+            future = _prefetching.get(key)
+        if future is not None:
+            futures[future] = (job, slot, key)
+        else:
+            pending.append((job, slot, key))
+
+    try:
+        executor = get_executor(max_workers)
+        futures.update({submit(executor, job): (job, slot, key) for job, slot, key in pending})
+    except (BrokenExecutor, RuntimeError):
+        # A worker died during an earlier run, or another session just replaced the pool; start from a fresh one
+        discard_executor(executor)
+        executor = get_executor(max_workers)
+        futures.update({submit(executor, job): (job, slot, key) for job, slot, key in pending})
+
+    for future in as_completed(futures):
+        job, slot, key = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            # e.g. a worker process died; only this patient is affected
+            if isinstance(e, BrokenExecutor):
+                discard_executor(executor)
+            # A cancelled future's message is empty, but the slot must still show an error
+            result = {"error": str(e) or type(e).__name__}
+
+        if not result["error"]:
+            thumbnail_cache.put(job["patient_id"], key, result["png"])
+        show_result(job, result, slot)
+
+
+def _store_prefetched(key, future):
+    # Runs in the executor's management thread once a prefetched job is done
+    try:
+        result = future.result()
+        if not result["error"]:
+            thumbnail_cache.put(result["patient_id"], key, result["png"])
+    except Exception:
+        # Rendered again, with the error shown, when the page is opened
+        pass
+    finally:
+        with _prefetch_lock:
+            _prefetching.pop(key, None)
+
+
+def prefetch(jobs, max_workers=DEFAULT_WORKERS):
+    """
+    Render jobs on the process pool without waiting for them, straight into the thumbnail cache.
+    They queue behind the jobs of the page on screen, so they only use otherwise idle workers.
+    """
+    try:
+        executor = get_executor(max_workers)
+        for job in jobs:
+            key = thumbnail_key(job)
+            with _prefetch_lock:
+                if key in _prefetching or thumbnail_cache.get(job["patient_id"], key) is not None:
+                    continue
+                future = _prefetching[key] = submit(executor, job)
+            future.add_done_callback(lambda future, key=key: _store_prefetched(key, future))
+    except (BrokenExecutor, RuntimeError):
+        # The next page is simply rendered when it is opened
+        discard_executor(executor)
+
+
+def page_controls(n_patients):
+    """Sidebar page size, sort order and page number; returns (page_size, sort_order, descending, page)."""
+    st.sidebar.subheader("Gallery")
+    page_size = st.sidebar.selectbox("Patients per page", PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE))
+    sort_order = st.sidebar.selectbox("Sort by", list(SORT_ORDERS))
+    descending = st.sidebar.checkbox("Descending")
+    page = page_number_input(st.sidebar, n_patients, page_size)
+    return page_size, sort_order, descending, page
+
+
+def sorted_patient_ids(hill_fits, sort_order, descending=False):
+    # Patients without a converged batch fit sort last in either direction
+    values = hill_fits[SORT_ORDERS[sort_order]].where(hill_fits["converged"])
+    return values.sort_values(ascending=not descending, na_position="last", kind="stable").index.to_numpy()
+
+
+def fit_patient_arrays(arrays):
+    # One vectorized Hill fit of the selected points of every patient in `arrays` (as from patient_arrays)
+    return fit_hill_batch(
+        [x[selected] for x, _, selected, _ in arrays.values()],
+        [y[selected] for _, y, selected, _ in arrays.values()],
+        patient_ids=list(arrays),
+    )
+
+
+@st.cache_data(max_entries=16, show_spinner="Fitting the Hill model for every patient...")
+def cohort_hill_fits(load_id, version, patient_ids, _data, _patient_index):
+    """
+    Batch Hill fit of all the given patients, needed to sort a gallery by MSE or Hill n. Cached per loaded
+    dataset, data version and list of patients, so paging and re-sorting reuse it until the data changes.
+    """
+    return fit_patient_arrays(patient_arrays(_data, _patient_index, patient_ids))
+
+
+def status_caption(is_ideal, is_problematic):
+    # Caption coloured by the patient's status
+    if is_problematic:
+        return ":red-background[Patient ID: {patient_id} - MSE: {mse:.4f}]"
+    if is_ideal:
+        return ":green-background[Patient ID: {patient_id} - MSE: {mse:.4f}]"
+    return "[Patient ID: {patient_id} - MSE: {mse:.4f}]"
+
+
+@traced()
+def render_patient_gallery(dataset, predicate=None, n_columns=3, color_by_status=False,
+                           empty_message="No patients available.", max_workers=DEFAULT_WORKERS):
+    """
+    One page of the Hill gallery of the patients selected by `predicate`, which maps PatientIndex.frame to a
+    boolean mask (None: every patient), in the chosen order; the next page is prefetched in the background.
+    `n_columns` and `color_by_status` set the layout of the page.
+    """
+    data, patient_index = dataset.data, dataset.patient_index
+    frame = patient_index.frame
+    patient_ids = frame.index.to_numpy() if predicate is None else frame.index.to_numpy()[np.asarray(predicate(frame), dtype=bool)]
+    if len(patient_ids) == 0:
+        st.info(empty_message)
+        return
+
+    page_size, sort_order, descending, page = page_controls(len(patient_ids))
+    hill_fits = None
+    if SORT_ORDERS[sort_order] is None:
+        # The patient index is sorted by ID already
+        ordered_ids = patient_ids[::-1] if descending else patient_ids
+    else:
+        # Sorting by a fit result needs every patient's fit
+        hill_fits = cohort_hill_fits(dataset.load_id, dataset.version, patient_ids, data, patient_index)
+        ordered_ids = sorted_patient_ids(hill_fits, sort_order, descending)
+    start = (page - 1) * page_size
+    page_ids = ordered_ids[start:start + page_size]
+    next_ids = ordered_ids[start + page_size:start + 2 * page_size]
+    st.caption(f"Patients {start + 1}–{start + len(page_ids)} of {len(ordered_ids)}, sorted by {sort_order}{' (descending)' if descending else ''}")
+
+    # Arrays, and unless sorted by a fit result also the fits, of only the visible and the prefetched page
+    arrays = patient_arrays(data, patient_index, np.concatenate([page_ids, next_ids]))
+    if hill_fits is None:
+        hill_fits = fit_patient_arrays(arrays)
+
+    def build_jobs(ids):
+        # Render jobs of the patients, in the given order, leaving out patients without selected measurements
+        jobs = []
+        for patient_id in ids:
+            x, y, selected, numbers = arrays[patient_id]
+            if not selected.any():
+                continue
+            fit = hill_fits.loc[patient_id]
+            jobs.append({
+                "patient_id": patient_id,
+                "x_selected": x[selected],
+                "y_selected": y[selected],
+                # Patients the batch fit did not converge for are fitted individually in the worker
+                "popt": fit[["L", "K", "n"]].to_numpy(dtype=float) if fit["converged"] else None,
+                "deselected_data": {
+                    "Insp. O2 (%)": x[~selected],
+                    "SpO2 (%)": y[~selected],
+                    "Measurement Nr": numbers[~selected],
+                },
+                "measurement_numbers_selected": numbers[selected],
+                "caption": status_caption(frame.at[patient_id, "is_ideal"], frame.at[patient_id, "is_problematic"])
+                if color_by_status else "Patient ID: {patient_id} - MSE: {mse:.4f}",
+            })
+        return jobs
+
+    jobs = build_jobs(page_ids)
+    with_jobs = {job["patient_id"] for job in jobs}
+    for patient_id in page_ids:
+        if patient_id not in with_jobs:
+            st.warning(f"Patient ID {patient_id} has no selected measurements to process.")
+    render_gallery(jobs, n_columns=n_columns, max_workers=max_workers)
+
+    if len(next_ids):
+        prefetch(build_jobs(next_ids), max_workers)
@@ -0,0 +1,50 @@
+import io
+import numpy as np
+from hill_equation import train_hill_model, plot_hill_fit
+from thumbnail_cache import png_metadata
+
+# Code run in the gallery's worker processes. It doesn't import Streamlit, so the forkserver can preload it
+# and workers start without importing the app.
+THUMBNAIL_DPI = 150
+
+
+def init_worker():
+    # Workers only ever render to PNG, never to a display
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def fit_and_render_patient(job):
+    """
+    Fit the Hill model for one patient and render the plot to PNG bytes.
+    Runs in a worker process, so both the job and the returned dict only hold picklable values.
+    """
+    result = {"patient_id": job["patient_id"], "popt": None, "mse": None, "png": None, "error": None}
+    try:
+        popt = job.get("popt")
+        if popt is None:
+            popt = train_hill_model(job["x_selected"], job["y_selected"])
+        if popt is None:
+            raise ValueError("curve fitting did not converge")
+
+        fig, mse = plot_hill_fit(
+            job["x_selected"],
+            job["y_selected"],
+            popt,
+            deselected_data=job["deselected_data"],
+            measurement_numbers_selected=job["measurement_numbers_selected"],
+        )
+        if fig is None:
+            raise ValueError("plot could not be generated")
+
+        popt = np.asarray(popt, dtype=float).tolist()
+        buffer = io.BytesIO()
+        # The fit result goes into the PNG too, so a cached thumbnail can be shown on its own
+        fig.savefig(buffer, format="png", dpi=THUMBNAIL_DPI, bbox_inches="tight", metadata=png_metadata({"popt": popt, "mse": float(mse)}))
+        # Plain Figure objects aren't tracked by pyplot; dropping the reference frees the figure
+        del fig
+
+        result.update(popt=popt, mse=float(mse), png=buffer.getvalue())
+    except Exception as e:
+        result["error"] = str(e)
+    return result
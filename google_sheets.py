@@ -1,6 +1,58 @@
+import random
+import threading
+import time
 import gspread
+from gspread.exceptions import APIError
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from gspread.utils import rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
 
+# Quota (429) and transient server errors are retried with exponential backoff
+RETRY_STATUS_CODES = {429, 500, 502, 503}
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 1.0
+
+
+def coalesce_updates(updates):
+    """
+    Turn (row, col, value) cell updates into as few contiguous A1 ranges as possible:
+    consecutive rows of a column become one range, and neighbouring columns covering
+    the same rows are merged into one rectangle. Later updates to the same cell win.
+    """
+    cells_by_column = {}
+    for row, col, value in updates:
+        cells_by_column.setdefault(col, {})[row] = value
+
+    # Runs of consecutive rows per column: (first_row, last_row, col, values)
+    runs = []
+    for col, cells in cells_by_column.items():
+        rows = sorted(cells)
+        first = rows[0]
+        for previous, row in zip(rows, rows[1:] + [None]):
+            if row is None or row != previous + 1:
+                runs.append((first, previous, col, [cells[r] for r in range(first, previous + 1)]))
+                first = row
+
+    # Merge runs of neighbouring columns that cover exactly the same rows
+    ranges = []
+    for first, last, col, values in sorted(runs):
+        previous = ranges[-1] if ranges else None
+        if previous and previous["rows"] == (first, last) and previous["last_col"] == col - 1:
+            previous["last_col"] = col
+            for row_values, value in zip(previous["values"], values):
+                row_values.append(value)
+        else:
+            ranges.append({"rows": (first, last), "first_col": col, "last_col": col, "values": [[value] for value in values]})
+
+    return [
+        {
+            "range": f"{rowcol_to_a1(r['rows'][0], r['first_col'])}:{rowcol_to_a1(r['rows'][1], r['last_col'])}",
+            "values": r["values"],
+        }
+        for r in ranges
+    ]
+
+
 class GoogleSheetsManager:
     def __init__(self, secrets):
         # Parse secrets
@@ -19,18 +71,106 @@ class GoogleSheetsManager:
 
         # Setup gspread client
         scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict, scope)
-        self.client = gspread.authorize(creds)
+        self.creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict, scope)
+
+        self.stats = {"auth": 0, "open_by_name": 0, "open_by_key": 0}
+        self._lock = threading.RLock()
+        self._spreadsheet_keys = {}  # sheet name -> spreadsheet key, so names are only looked up once
+        self._worksheets = {}  # sheet name -> first worksheet handle
+        self._authorize()
+
+    def _authorize(self):
+        # The authorized session refreshes the access token by itself whenever it expires
+        self.client = gspread.authorize(self.creds)
+        self.stats["auth"] += 1
+        # Worksheet handles are bound to the client they were opened with
+        self._worksheets.clear()
 
     def get_sheet(self, sheet_name):
-        """Open a Google Sheet by name."""
-        return self.client.open(sheet_name).sheet1
+        """Open a Google Sheet by name, reusing the worksheet handle and the resolved spreadsheet key."""
+        with self._lock:
+            if sheet_name not in self._worksheets:
+                if sheet_name in self._spreadsheet_keys:
+                    spreadsheet = self.client.open_by_key(self._spreadsheet_keys[sheet_name])
+                    self.stats["open_by_key"] += 1
+                else:
+                    # Opening by name is a Drive search; remember the key for next time
+                    spreadsheet = self.client.open(sheet_name)
+                    self.stats["open_by_name"] += 1
+                    self._spreadsheet_keys[sheet_name] = spreadsheet.id
+                self._worksheets[sheet_name] = spreadsheet.sheet1
+            return self._worksheets[sheet_name]
+
+    def get_modified_time(self, sheet_name):
+        """
+        Last modification time of the spreadsheet from Drive metadata, without downloading any values.
+        Always asked from Drive: the pooled worksheet handle only knows the time it was opened at.
+        """
+        key = self.get_sheet(sheet_name).spreadsheet.id
+        # gspread 6 moved the raw request method from the client to its HTTP client
+        http_client = getattr(self.client, "http_client", self.client)
+        response = http_client.request(
+            "get",
+            f"{DRIVE_FILES_API_V3_URL}/{key}",
+            params={"fields": "modifiedTime", "supportsAllDrives": True},
+        )
+        return response.json()["modifiedTime"]
 
     def update_cell(self, sheet, row, col, value):
         """Update a single cell."""
         sheet.update_cell(row, col, value)
 
     def update_multiple_cells(self, sheet, updates):
-        """Batch update multiple cells."""
-        for row, col, value in updates:
-            sheet.update_cell(row, col, value)
+        """
+        Batch update multiple cells in a single request.
+        Returns (and keeps in `last_update_stats`) the number of cells, ranges and requests issued and the latency.
+        """
+        started = time.perf_counter()
+        ranges = coalesce_updates(updates)
+        requests = 0
+        if ranges:
+            requests = self._with_retry(lambda: sheet.batch_update(ranges, value_input_option="USER_ENTERED"))
+
+        self.last_update_stats = {
+            "cells": len(updates),
+            "ranges": len(ranges),
+            "requests": requests,
+            "latency": time.perf_counter() - started,
+        }
+        return self.last_update_stats
+
+    def _with_retry(self, request):
+        """Run `request`, retrying quota and transient errors. Returns the number of requests issued."""
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                request()
+                return attempt
+            except APIError as e:
+                status = getattr(e.response, "status_code", None)
+                if status not in RETRY_STATUS_CODES or attempt == MAX_ATTEMPTS:
+                    raise
+                time.sleep(BACKOFF_SECONDS * 2 ** (attempt - 1) + random.uniform(0, BACKOFF_SECONDS))
+
+
+# Process-wide pool of authorized managers, one per service account, shared by all sessions and threads
+_pool_lock = threading.Lock()
+_managers = {}
+
+
+def get_sheets_manager(secrets):
+    key = (secrets["client_email"], secrets["private_key_id"])
+    with _pool_lock:
+        if key not in _managers:
+            _managers[key] = GoogleSheetsManager(secrets)
+        return _managers[key]
+
+
+def pool_stats():
+    """Authorization and spreadsheet-open counters summed over all pooled managers."""
+    with _pool_lock:
+        managers = list(_managers.values())
+    totals = {"auth": 0, "open_by_name": 0, "open_by_key": 0}
+    for manager in managers:
+        for name, count in manager.stats.items():
+            totals[name] += count
+    return totals
@@ -1,33 +1,134 @@
+import logging
 import numpy as np
-import streamlit as st
+import pandas as pd
 from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
+from fit_cache import fit_cache
+from plotting import plot_fit
+from tracing import span, traced
+
+# Fitting and plotting don't depend on Streamlit; failures are logged and callers decide how to show them
+logger = logging.getLogger(__name__)
 
 # Hill equation
 def hill_eq(x, L, K, n):
     return L * (x**n / (K**n + x**n))
 
-# Function to train the Hill model
-def train_hill_model(x_data, y_data):
-    # Updated initial guesses and tighter bounds for improved fitting
-    p0 = [90, 15, 1.5]
-    lower_bounds = [80, 10, 0]
-    upper_bounds = [100, 35, 10]
+# Fallback initial guess and tighter bounds for improved fitting
+HILL_P0 = [90, 15, 1.5]
+HILL_LOWER_BOUNDS = [80, 10, 0]
+HILL_UPPER_BOUNDS = [100, 35, 10]
 
-    
-    try:
+# r = x^n / (K^n + x^n), written as 1 / (1 + (K/x)^n) to avoid overflow; r = 0 at x <= 0
+def _hill_ratio(x, K, n, positive):
+    x_safe = np.where(positive, x, 1.0)
+    with np.errstate(over="ignore"):
+        return np.where(positive, 1.0 / (1.0 + (K / x_safe) ** n), 0.0), x_safe
+
+# Closed-form Jacobian of the Hill equation with respect to (L, K, n)
+def hill_jacobian(x, L, K, n):
+    x = np.asarray(x, dtype=float)
+    positive = x > 0
+    r, x_safe = _hill_ratio(x, K, n, positive)
+    slope = r * (1.0 - r)
+    return np.stack([
+        r,
+        -L * n * slope / K,
+        np.where(positive, L * slope * np.log(x_safe / K), 0.0),
+    ], axis=-1)
+
+# Initial guess from the linearized Hill equation: log(y / (L - y)) = n*log(x) - n*log(K)
+def hill_initial_guess(x_data, y_data, mask=None):
+    """
+    Works on a single patient's 1D arrays or on padded 2D arrays (one row per patient) with a mask.
+    Falls back to HILL_P0 where the points don't allow a sensible estimate.
+    """
+    x = np.atleast_2d(np.asarray(x_data, dtype=float))
+    y = np.atleast_2d(np.asarray(y_data, dtype=float))
+    mask = np.ones(x.shape, dtype=bool) if mask is None else np.atleast_2d(np.asarray(mask, dtype=bool))
+    lower = np.array(HILL_LOWER_BOUNDS, dtype=float)
+    upper = np.array(HILL_UPPER_BOUNDS, dtype=float)
+
+    # The plateau has to sit above every point that enters the logit
+    y_max = np.max(np.where(mask, y, -np.inf), axis=1, initial=-np.inf)
+    L = np.clip(y_max + 1.0, lower[0], upper[0])
+
+    usable = mask & (x > 0) & (y > 0) & (y < L[:, None])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_x = np.where(usable, np.log(np.where(usable, x, 1.0)), 0.0)
+        logit = np.where(usable, np.log(np.where(usable, y, 1.0) / np.where(usable, L[:, None] - y, 1.0)), 0.0)
+
+        # Least-squares line through (log_x, logit) for every row at once
+        count = usable.sum(axis=1)
+        sum_x, sum_y = log_x.sum(axis=1), logit.sum(axis=1)
+        denominator = count * (log_x ** 2).sum(axis=1) - sum_x ** 2
+        n = (count * (log_x * logit).sum(axis=1) - sum_x * sum_y) / denominator
+        K = np.exp((n * sum_x - sum_y) / (count * n))
+
+    valid = (count >= 2) & (denominator > 1e-12) & (n > 0) & np.isfinite(K)
+    guess = np.tile(np.array(HILL_P0, dtype=float), (x.shape[0], 1))
+    guess[valid] = np.column_stack([L, K, n])[valid]
+    guess = np.clip(guess, lower, upper)
+    return guess[0] if np.ndim(x_data) == 1 else guess
+
+# Function to train the Hill model, reusing a cached fit when the selected points haven't changed.
+# With return_info=True the fit statistics (function/Jacobian evaluations, starting point) are returned too.
+# A given p0 (e.g. the patient's previous parameters) is tried first; if that fit fails it starts over from the usual initial guess.
+# If the fit fails, popt is None and the info holds the error message.
+@traced()
+def train_hill_model(x_data, y_data, return_info=False, p0=None):
+    popt = None
+    if p0 is not None:
+        popt, info = _cached_hill_fit(x_data, y_data, np.clip(p0, HILL_LOWER_BOUNDS, HILL_UPPER_BOUNDS), warm_start=True)
+    if popt is None:
+        popt, info = _cached_hill_fit(x_data, y_data, hill_initial_guess(x_data, y_data), warm_start=False)
+        if popt is None:
+            logger.warning("Error in curve fitting: %s", info["error"])
+    return (popt, info) if return_info else popt
+
+def _cached_hill_fit(x_data, y_data, p0, warm_start):
+    failure = {"error": None, "cached": False, "warm_start": warm_start}
+
+    def fit():
+        try:
+            return _fit_hill_model(x_data, y_data, p0)
+        except Exception as e:
+            failure["error"] = str(e)
+            return None
+
+    result, cached = fit_cache.get_or_fit(
+        "hill",
+        x_data,
+        y_data,
+        (tuple(p0), HILL_LOWER_BOUNDS, HILL_UPPER_BOUNDS),
+        fit,
+    )
+    if result is None:
+        return None, failure
+    result[1].update(cached=cached, warm_start=warm_start)
+    return result
+
+def _fit_hill_model(x_data, y_data, p0):
+    counts = {"nfev": 0, "njev": 0}
+
+    def model(x, *params):
+        counts["nfev"] += 1
+        return hill_eq(x, *params)
+
+    def jacobian(x, *params):
+        counts["njev"] += 1
+        return hill_jacobian(x, *params)
+
+    with span("curve_fit", model="hill", points=len(x_data)):
         popt, pcov = curve_fit(
-            hill_eq,
+            model,
             x_data,
             y_data,
             p0=p0,
-            bounds=(lower_bounds, upper_bounds),
+            jac=jacobian,
+            bounds=(HILL_LOWER_BOUNDS, HILL_UPPER_BOUNDS),
             method='trf'
         )
-        return popt
-    except Exception as e:
-        st.error(f"Error in curve fitting: {e}")
-        return None
+    return popt, {"nfev": counts["nfev"], "njev": counts["njev"], "p0": np.asarray(p0).tolist()}
 
 # Function to generate Hill fit and calculate MSE
 def generate_hill_fit(x_data, y_data, popt):
@@ -41,49 +142,150 @@ def generate_hill_fit(x_data, y_data, popt):
     return x_range, y_fitted, mse
 
 
+# Pad ragged per-patient arrays into (patients, points) arrays plus a mask of valid entries
+def pad_patient_arrays(x_list, y_list):
+    n_patients = len(x_list)
+    width = max((len(x) for x in x_list), default=0)
+    x = np.ones((n_patients, width))
+    y = np.zeros((n_patients, width))
+    mask = np.zeros((n_patients, width), dtype=bool)
+    for i, (x_patient, y_patient) in enumerate(zip(x_list, y_list)):
+        x[i, :len(x_patient)] = x_patient
+        y[i, :len(y_patient)] = y_patient
+        mask[i, :len(x_patient)] = True
+    return x, y, mask
+
+
+# Residuals and Jacobian of the Hill equation for every patient at once
+def _hill_batch_residuals(params, x, y, mask):
+    L, K, n = params[:, 0:1], params[:, 1:2], params[:, 2:3]
+    r, _ = _hill_ratio(x, K, n, mask & (x > 0))
+    residuals = np.where(mask, L * r - y, 0.0)
+    jacobian = np.where(mask[:, :, None], hill_jacobian(x, L, K, n), 0.0)
+    return residuals, jacobian
+
+
+# Fit the Hill model for many patients at once with a bounded Levenberg-Marquardt loop
+def fit_hill_batch(x, y, mask=None, patient_ids=None, max_iter=200, ftol=1e-10, gtol=1e-8):
+    """
+    x, y are either lists of per-patient arrays or padded 2D arrays with a boolean mask.
+    Returns one row per patient with L, K, n, MSE, convergence flag and iteration count.
+    """
+    if mask is None and not isinstance(x, np.ndarray):
+        x, y, mask = pad_patient_arrays(x, y)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if mask is None:
+        mask = np.isfinite(x) & np.isfinite(y)
+    mask = np.asarray(mask, dtype=bool)
+    x = np.where(mask, x, 1.0)
+    y = np.where(mask, y, 0.0)
+
+    n_patients = x.shape[0]
+    lower = np.array(HILL_LOWER_BOUNDS, dtype=float)
+    upper = np.array(HILL_UPPER_BOUNDS, dtype=float)
+    params = hill_initial_guess(x, y, mask).reshape(n_patients, 3)
+    damping = np.full(n_patients, 1e-3)
+    iterations = np.zeros(n_patients, dtype=int)
+    counts = mask.sum(axis=1)
+    # converged: a minimum was reached; stalled: no further step reduces the cost, which is not a fit
+    converged = np.zeros(n_patients, dtype=bool)
+    stalled = np.zeros(n_patients, dtype=bool)
+    identity = np.eye(3)
+
+    residuals, jacobian = _hill_batch_residuals(params, x, y, mask)
+    cost = np.sum(residuals ** 2, axis=1)
+
+    for _ in range(max_iter):
+        # Only the patients still being fitted are computed on
+        active = np.flatnonzero(~converged & ~stalled & (counts > 0))
+        if len(active) == 0:
+            break
+        iterations[active] += 1
+        p, r, J, c = params[active], residuals[active], jacobian[active], cost[active]
+        x_a, y_a, mask_a = x[active], y[active], mask[active]
+
+        gradient = np.einsum("pmi,pm->pi", J, r)
+        hessian = np.einsum("pmi,pmj->pij", J, J)
+
+        # Parameters sitting on a bound with the gradient pushing outwards are held fixed
+        blocked = ((p <= lower) & (gradient > 0)) | ((p >= upper) & (gradient < 0))
+        free = ~blocked
+        at_minimum = np.max(np.abs(gradient * free), axis=1) <= gtol * np.maximum(c, 1.0)
+        gradient = gradient * free
+        hessian = hessian * free[:, :, None] * free[:, None, :] + blocked[:, :, None] * identity
+
+        diagonal = np.maximum(np.diagonal(hessian, axis1=1, axis2=2), 1e-12)
+        damped = hessian + damping[active, None, None] * diagonal[:, :, None] * identity
+        step = np.linalg.solve(damped, -gradient[:, :, None])[:, :, 0]
+
+        candidate = np.clip(p + step * free, lower, upper)
+        candidate_residuals, candidate_jacobian = _hill_batch_residuals(candidate, x_a, y_a, mask_a)
+        candidate_cost = np.sum(candidate_residuals ** 2, axis=1)
+
+        improved = ~at_minimum & (candidate_cost < c)
+        small_change = improved & (c - candidate_cost <= ftol * np.maximum(c, 1e-12))
+
+        params[active] = np.where(improved[:, None], candidate, p)
+        residuals[active] = np.where(improved[:, None], candidate_residuals, r)
+        jacobian[active] = np.where(improved[:, None, None], candidate_jacobian, J)
+        cost[active] = np.where(improved, candidate_cost, c)
+
+        damping[active] = np.where(improved, np.maximum(damping[active] / 3, 1e-12), damping[active] * 4)
+        converged[active] = at_minimum | small_change
+        # A damping this large means no step along the gradient reduces the cost any more
+        stalled[active] = ~converged[active] & (damping[active] > 1e12)
+
+    # Stalled fits, fits still running after max_iter and fits stuck at n = 0, where the curve is flat and
+    # the K gradient vanishes, are reported as not converged, so callers fall back to train_hill_model
+    converged &= ~stalled & (params[:, 2] > lower[2])
+
+    mse = np.full(n_patients, np.nan)
+    np.divide(cost, counts, out=mse, where=counts > 0)
+    params[counts == 0] = np.nan
+
+    return pd.DataFrame(
+        {
+            "L": params[:, 0],
+            "K": params[:, 1],
+            "n": params[:, 2],
+            "mse": mse,
+            "converged": converged & (counts > 0),
+            "iterations": iterations,
+        },
+        index=pd.Index(patient_ids if patient_ids is not None else np.arange(n_patients), name="Patient_ID"),
+    )
+
+
+# Batch-fit the Hill model on the selected measurements of every patient in `data`
+@traced()
+def fit_hill_patients(data):
+    # Group the selected points by patient with one stable sort instead of a pandas groupby
+    patient_ids, inverse = np.unique(data["Patient_ID"].to_numpy(), return_inverse=True)
+    selected = data["selected_measurement"].to_numpy() == 1
+    order = np.argsort(inverse[selected], kind="stable")
+    split_at = np.cumsum(np.bincount(inverse[selected], minlength=len(patient_ids)))[:-1]
+    x_list = np.split(data["Insp. O2 (%)"].to_numpy(dtype=float)[selected][order], split_at)
+    y_list = np.split(data["SpO2 (%)"].to_numpy(dtype=float)[selected][order], split_at)
+    return fit_hill_batch(x_list, y_list, patient_ids=patient_ids)
 
 
+@traced()
 def plot_hill_fit(x_selected, y_selected, popt, deselected_data=None, measurement_numbers_selected=None):
     try:
         x_range, y_fitted, mse = generate_hill_fit(x_selected, y_selected, popt)
     except Exception as e:
-        st.error(f"Error generating Hill fit: {e}")
+        logger.warning("Error generating Hill fit: %s", e)
         return None, None
 
-    fig, ax = plt.subplots()
-
-    selected_points = set(zip(x_selected, y_selected))
-
-    # Plot selected data points with optional labels
-    if measurement_numbers_selected is not None:
-        for i, (x, y, label) in enumerate(zip(x_selected, y_selected, measurement_numbers_selected)):
-            ax.scatter(x, y, color="blue", label="Selected Data" if i == 0 else "")
-            ax.text(x, y + 0.5, f"{label}", fontsize=10, ha="center", color="blue", fontweight="bold")
-    else:
-        ax.scatter(x_selected, y_selected, color="blue", label="Selected Data")
-
-    # Plot deselected data points if provided
-    if deselected_data is not None:
-        for i, (x, y, label) in enumerate(zip(
-            deselected_data["Insp. O2 (%)"], 
-            deselected_data["SpO2 (%)"], 
-            deselected_data["Measurement Nr"]
-        )):
-            # Skip specific points (0,0) and (9.7,50) if they are deselected
-            if (x, y) == (0, 0):
-                continue
-            if (x, y) == (9.7, 50) and (0, 0) in selected_points:
-                pass  # Show as deselected
-            elif (x, y) in [(9.7, 50), (0, 0)]:
-                continue
-            ax.scatter(x, y, color="grey", label="Deselected Data" if i == 0 else "", alpha=0.6)
-            ax.text(x, y + 0.5, f"{label}", fontsize=10, ha="center", color="grey", fontweight="bold")
-
-    # Plot the fitted Hill curve
-    ax.plot(x_range, y_fitted, color="red", label="Fitted Hill Curve")
-    ax.set_title(f"Hill Fit (MSE: {mse:.4f})")
-    ax.set_xlabel("Insp. O2 (%)")
-    ax.set_ylabel("SpO2 (%)")
-    ax.legend()
-    
+    fig = plot_fit(
+        x_selected,
+        y_selected,
+        x_range,
+        y_fitted,
+        f"Hill Fit (MSE: {mse:.4f})",
+        "Fitted Hill Curve",
+        deselected_data=deselected_data,
+        measurement_numbers_selected=measurement_numbers_selected,
+    )
     return fig, mse
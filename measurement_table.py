@@ -3,6 +3,8 @@ import numpy as np
 import pandas as pd
 from attribute_checkboxes import attribute_checkboxes
 from data_connector import save_data
+from anchor_points import N_ANCHORS
+from tracing import span
 
 def measurement_table(patient_data):
     st.subheader("Measurements")
@@ -17,15 +19,18 @@ def measurement_table(patient_data):
     table_data = patient_data[["Measurement Nr", "Insp. O2 (%)", "SpO2 (%)"]].copy()
     table_data["Include in model"] = st.session_state.selected_measurements
 
-    for col in ["Measurement Nr"]:
-        table_data.loc[:1, col] = table_data.loc[:1, col].apply(lambda x: f"{x} 📚 ")
-
-    updated_table = st.data_editor(
-      table_data,
-      column_config={"Include in model": st.column_config.CheckboxColumn()},
-      disabled=["Measurement Nr", "Insp. O2 (%)", "SpO2 (%)"],
-      hide_index=True
-    )
+    # Mark the virtual anchor rows
+    table_data["Measurement Nr"] = [
+        f"{nr} 📚 " if i < N_ANCHORS else str(nr) for i, nr in enumerate(table_data["Measurement Nr"])
+    ]
+
+    with span("st.data_editor", rows=len(table_data)):
+        updated_table = st.data_editor(
+          table_data,
+          column_config={"Include in model": st.column_config.CheckboxColumn()},
+          disabled=["Measurement Nr", "Insp. O2 (%)", "SpO2 (%)"],
+          hide_index=True
+        )
 
 
     return updated_table
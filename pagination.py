@@ -0,0 +1,13 @@
+import math
+
+
+def page_number_input(container, n_items, page_size):
+    """
+    Page number widget in `container` (st or st.sidebar) for `n_items` shown `page_size` at a time;
+    returns the 1-based page, and only shows the widget when there is more than one page.
+    """
+    n_pages = max(math.ceil(n_items / page_size), 1)
+    if n_pages == 1:
+        return 1
+    # No key: the widget starts over on page 1 whenever the number of pages changes
+    return int(container.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1))
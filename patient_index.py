@@ -0,0 +1,152 @@
+from bisect import bisect_left, bisect_right, insort
+import numpy as np
+import pandas as pd
+from anchor_points import N_ANCHORS
+
+STATUS_COLUMNS = ["is_ideal", "is_processed", "is_problematic"]
+
+
+class NavigationIndex:
+    """
+    Sorted unique patient IDs and sorted unprocessed patient IDs,
+    so previous/next lookups are O(log n) bisections instead of scans over the data.
+    """
+
+    def __init__(self, patient_ids, unprocessed_ids):
+        self.patient_ids = sorted(int(pid) for pid in patient_ids)
+        self.unprocessed_ids = sorted(int(pid) for pid in unprocessed_ids)
+
+    @staticmethod
+    def _previous(ids, patient_id):
+        i = bisect_left(ids, patient_id)
+        return ids[i - 1] if i > 0 else None
+
+    @staticmethod
+    def _next(ids, patient_id):
+        i = bisect_right(ids, patient_id)
+        return ids[i] if i < len(ids) else None
+
+    def previous_patient(self, patient_id):
+        return self._previous(self.patient_ids, patient_id)
+
+    def next_patient(self, patient_id):
+        return self._next(self.patient_ids, patient_id)
+
+    def previous_unprocessed(self, patient_id):
+        return self._previous(self.unprocessed_ids, patient_id)
+
+    def next_unprocessed(self, patient_id):
+        return self._next(self.unprocessed_ids, patient_id)
+
+    def set_processed(self, patient_id, is_processed):
+        patient_id = int(patient_id)
+        i = bisect_left(self.unprocessed_ids, patient_id)
+        listed = i < len(self.unprocessed_ids) and self.unprocessed_ids[i] == patient_id
+        if is_processed and listed:
+            del self.unprocessed_ids[i]
+        elif not is_processed and not listed:
+            insort(self.unprocessed_ids, patient_id)
+
+
+class PatientIndex:
+    """
+    Compact per-patient summary of the dataset, built once at load time.
+
+    One row per Patient_ID (sorted) with the status flags and comment of the patient's first
+    measurement, the label of that first row, the patient's row span [start, stop) in `data`
+    and the number of measurements. Expects `data` sorted by Patient_ID and Insp. O2 (%).
+    """
+
+    def __init__(self, data):
+        patient_ids, starts, counts = np.unique(data["Patient_ID"].to_numpy(), return_index=True, return_counts=True)
+        first_rows = data.iloc[starts]
+
+        self.frame = pd.DataFrame(
+            {
+                "first_row": first_rows.index.to_numpy(),
+                "start": starts,
+                "stop": starts + counts,
+                "n_measurements": counts,
+                **{column: first_rows[column].to_numpy() == 1 for column in STATUS_COLUMNS},
+                "comment": first_rows["comment"].to_numpy(),
+            },
+            index=pd.Index(patient_ids, name="Patient_ID"),
+        )
+        self.navigation = NavigationIndex(patient_ids, self.unprocessed_ids())
+
+    def ids_where(self, column, value=True):
+        return self.frame.index[self.frame[column] == value].to_numpy()
+
+    def ideal_ids(self):
+        return self.ids_where("is_ideal")
+
+    def problematic_ids(self):
+        return self.ids_where("is_problematic")
+
+    def processed_ids(self):
+        return self.ids_where("is_processed")
+
+    def unprocessed_ids(self):
+        return self.ids_where("is_processed", False)
+
+    def filter_ids(self, ideal=False, processed=False, problematic=False, unprocessed=False):
+        """Sorted IDs of patients matching every enabled filter, as one vectorized mask intersection."""
+        mask = np.ones(len(self.frame), dtype=bool)
+        if ideal:
+            mask &= self.frame["is_ideal"].to_numpy(dtype=bool)
+        if processed:
+            mask &= self.frame["is_processed"].to_numpy(dtype=bool)
+        if problematic:
+            mask &= self.frame["is_problematic"].to_numpy(dtype=bool)
+        if unprocessed:
+            mask &= ~self.frame["is_processed"].to_numpy(dtype=bool)
+        return self.frame.index.to_numpy()[mask]
+
+    def positions(self, patient_ids):
+        """Row positions in `data` of all measurements of the given patients, in data order."""
+        spans = self.frame.loc[np.sort(patient_ids), ["start", "stop"]].to_numpy()
+        if len(spans) == 0:
+            return np.empty(0, dtype=int)
+        lengths = spans[:, 1] - spans[:, 0]
+        # Expand every [start, stop) span without a Python loop
+        offsets = np.repeat(spans[:, 0] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return np.arange(lengths.sum()) + offsets
+
+    def span(self, patient_id):
+        """Row span [start, stop) of the patient in `data`, or None for an unknown patient."""
+        if patient_id not in self.frame.index:
+            return None
+        start, stop = self.frame.loc[patient_id, ["start", "stop"]]
+        return int(start), int(stop)
+
+    def rows(self, data, patient_id):
+        """The patient's rows in `data` as a slice (empty for an unknown patient), without scanning the data."""
+        span = self.span(patient_id)
+        return data.iloc[0:0] if span is None else data.iloc[span[0]:span[1]]
+
+    def update(self, patient_id, **values):
+        """Update the summary of one patient in place, e.g. after saving their labels."""
+        for column, value in values.items():
+            self.frame.at[patient_id, column] = value
+        if "is_processed" in values:
+            self.navigation.set_processed(patient_id, values["is_processed"])
+
+
+def patient_arrays(data, patient_index, patient_ids):
+    """
+    Per-patient (x, y, selected, measurement numbers) arrays of the given patients, by patient ID.
+    Each column is converted once and cut at the patients' row spans with np.split, without per-patient
+    DataFrames. Measurements are numbered after the anchor points, as on the Label page.
+    """
+    patient_ids = np.sort(np.asarray(patient_ids))
+    spans = patient_index.frame.loc[patient_ids, ["start", "stop"]].to_numpy()
+    lengths = spans[:, 1] - spans[:, 0]
+    positions = patient_index.positions(patient_ids)
+    split_at = np.cumsum(lengths)[:-1]
+
+    x = np.split(data["Insp. O2 (%)"].to_numpy(dtype=float)[positions], split_at)
+    y = np.split(data["SpO2 (%)"].to_numpy(dtype=float)[positions], split_at)
+    selected = np.split(data["selected_measurement"].to_numpy()[positions] == 1, split_at)
+    first = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    numbers = np.split(np.arange(len(positions)) - first + N_ANCHORS + 1, split_at)
+    return dict(zip(patient_ids.tolist(), zip(x, y, selected, numbers)))
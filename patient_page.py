@@ -3,25 +3,26 @@ import numpy as np
 import pandas as pd
 from visualisations import button_models
 from measurement_table import display_table_attributes
-from data_connector import load_all
+from data_connector import get_dataset, load_all, render_sheet_status
 from patient_sidebar import render_patient_sidebar
+from anchor_points import with_anchor_rows
+from tracing import begin_rerun, render_timing_panel
 from google_sheets import GoogleSheetsManager
 
 
 def patient_page():
-    
-    if "data" not in st.session_state:
-        data, problematic_patients , ideal_patients, unprocessed_patients, patient_ids = load_all()
-    else:
-        data = st.session_state.data
-        patient_ids = st.session_state.patient_ids
+    begin_rerun()
+    data, patient_ids = load_all()
 
     # Create two columns: left for navigation, right for main content
     col_nav, col_main = st.columns([1, 4])  # Adjust ratios as needed
 
     with col_nav:
-        #render_patient_sidebar(data, patient_ids)
-        render_patient_sidebar()
+        render_sheet_status()
+        # Filled after the main content, so a save made below already shows in the patient list
+        sidebar = st.container()
+
+    patient_index = get_dataset().patient_index
 
     # Main content area
     with col_main:
@@ -34,22 +35,30 @@ def patient_page():
             patient_id = 1
             st.session_state["patient_id"] = patient_id
 
-        patient_data = data[data["Patient_ID"] == patient_id].reset_index(drop=True)
+        # The patient's rows come straight from the index span; the 0/0 and P50 anchor points are added as the first two rows
+        patient_data = patient_index.rows(data, patient_id)
+        if not patient_data.empty:
+            patient_data = with_anchor_rows(patient_data)
 
         st.header(f"Patient {patient_id}")
 
-        if not patient_data.empty:
-            is_processed = bool(patient_data["is_processed"].iloc[0])
-            status_color = "green" if is_processed else "red"
-            status_text = "Patient Processed" if is_processed else "Patient Not Processed"
-            st.markdown(f"<div style='background-color:{status_color}; padding:10px; border-radius:5px; text-align:center; color:white;'>{status_text}</div>", unsafe_allow_html=True)
+        # Filled after the table, so it shows the status including a save made below
+        status_banner = st.empty()
             
         if not patient_data.empty:
             updated_table = display_table_attributes(patient_data, data, patient_id)
+
+            is_processed = bool(patient_index.frame.at[patient_id, "is_processed"])
+            status_color = "green" if is_processed else "red"
+            status_text = "Patient Processed" if is_processed else "Patient Not Processed"
+            status_banner.markdown(f"<div style='background-color:{status_color}; padding:10px; border-radius:5px; text-align:center; color:white;'>{status_text}</div>", unsafe_allow_html=True)
             
             if st.button("Models"):
                 button_models(patient_data, updated_table)
 
-        
-                
+    with sidebar:
+        render_patient_sidebar()
 
+    # Only shown when tracing is enabled
+    with col_main:
+        render_timing_panel()
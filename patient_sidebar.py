@@ -1,42 +1,32 @@
+import numpy as np
 import streamlit as st
-from data_connector import load_all
+from data_connector import get_dataset
+from pagination import page_number_input
+from tracing import traced
 
-if "data" not in st.session_state:
-    data, problematic_patients , ideal_patients, unprocessed_patients, patient_ids = load_all()
-else:
-    data = st.session_state.data
-    patient_ids = st.session_state.patient_ids
+# Patients listed per page of the selector table
+SELECTOR_PAGE_SIZE = 50
 
-def is_ideal(data, pid):
-    return bool(data[data["Patient_ID"] == pid]["is_ideal"].iloc[0])
 
-def is_problematic(data, pid):
-    return bool(data[data["Patient_ID"] == pid]["is_problematic"].iloc[0])
+def search_mask(frame, query):
+    """Patients whose ID starts with the query or whose comment contains it (case-insensitive)."""
+    query = query.strip()
+    if not query:
+        return np.ones(len(frame), dtype=bool)
+    id_matches = np.asarray(frame.index.astype(str).str.startswith(query), dtype=bool)
+    comment_matches = frame["comment"].fillna("").astype(str).str.contains(query, case=False, regex=False).to_numpy(dtype=bool)
+    return id_matches | comment_matches
 
-def is_unprocessed(data, pid):
-    return bool(data[data["Patient_ID"] == pid]["is_processed"].iloc[0]) == False
 
-def is_processed(data, pid):
-    return bool(data[data["Patient_ID"] == pid]["is_processed"].iloc[0]) == True
+def _select_patient(key, page_ids):
+    # Runs before the rerun, so the page already shows the clicked patient
+    rows = st.session_state[key].selection.rows
+    if rows:
+        st.session_state["patient_id"] = int(page_ids[rows[0]])
 
-def get_status_label(data, pid):
-    labels = []
-    if is_ideal(data, pid):
-        labels.append("ideal")
-    if is_processed(data, pid):
-        labels.append("processed")
-    else:
-        labels.append("not processed")
-    if is_problematic(data, pid):
-        labels.append("problematic")
-    return ", ".join(labels)
 
+@traced()
 def render_patient_sidebar():
-    if "data" not in st.session_state:
-        data, problematic_patients , ideal_patients, unprocessed_patients, patient_ids = load_all()
-    else:
-        data = st.session_state.data
-        patient_ids = st.session_state.patient_ids
 
     st.markdown("### Patient Filters")
     show_ideal = st.checkbox("Filter for Ideal", value=False)
@@ -50,28 +40,39 @@ def render_patient_sidebar():
         "problematic": show_problematic,
         "unprocessed": show_unprocessed,
     }
-    
-    # Filter patient IDs based on selection
-    filtered_patient_ids = []
-    for pid in patient_ids:
-        if selected_filters["ideal"] and not is_ideal(data, pid):
-            continue
-        if selected_filters["processed"] and not is_processed(data, pid):
-            continue
-        if selected_filters["problematic"] and not is_problematic(data, pid):
-            continue
-        if selected_filters["unprocessed"] and not is_unprocessed(data, pid):
-            continue
-        
-        filtered_patient_ids.append(pid)
-    
+
+    # Filter patient IDs based on selection, using the precomputed status columns of the patient index
+    patient_index = get_dataset().patient_index
+    filtered_patient_ids = patient_index.filter_ids(**selected_filters)
+
     st.markdown("#### Patient List")
-    st.markdown("<div class='scrollable-patient-list'>", unsafe_allow_html=True)
-    
-    for pid in sorted(filtered_patient_ids):
-        label = f"Patient {pid}: {get_status_label(data, pid)}"
-        if st.button(label, key=f"select_{pid}"):
-            st.session_state["patient_id"] = pid
-            st.rerun()
-    
-    st.markdown("</div>", unsafe_allow_html=True)
+    query = st.text_input("Search", placeholder="Patient ID or comment")
+    if query.strip():
+        frame = patient_index.frame.loc[filtered_patient_ids]
+        filtered_patient_ids = filtered_patient_ids[search_mask(frame, query)]
+
+    # Only one page of patients is sent to the browser, so the cost of a rerun doesn't grow with the cohort
+    page = page_number_input(st, len(filtered_patient_ids), SELECTOR_PAGE_SIZE)
+    start = (page - 1) * SELECTOR_PAGE_SIZE
+    page_ids = filtered_patient_ids[start:start + SELECTOR_PAGE_SIZE]
+    st.caption(f"{len(filtered_patient_ids)} patient(s); click a row to open the patient.")
+
+    table = patient_index.frame.loc[page_ids, ["is_ideal", "is_processed", "is_problematic", "n_measurements", "comment"]]
+    # A new key per list of patients and open patient, so a row selection never outlives the list it was made in
+    # and clicking the same row again after navigating away still opens that patient
+    key = f"patient_selector_{hash((tuple(page_ids.tolist()), st.session_state.get('patient_id')))}"
+    st.dataframe(
+        table.reset_index(),
+        key=key,
+        on_select=lambda: _select_patient(key, page_ids),
+        selection_mode="single-row",
+        hide_index=True,
+        column_config={
+            "Patient_ID": st.column_config.NumberColumn("Patient", format="%d"),
+            "is_ideal": st.column_config.CheckboxColumn("Ideal"),
+            "is_processed": st.column_config.CheckboxColumn("Processed"),
+            "is_problematic": st.column_config.CheckboxColumn("Problematic"),
+            "n_measurements": st.column_config.NumberColumn("Measurements"),
+            "comment": st.column_config.TextColumn("Comment"),
+        },
+    )
@@ -0,0 +1,57 @@
+import numpy as np
+from matplotlib.figure import Figure
+from anchor_points import ANCHOR_POINTS
+
+LABEL_OFFSET = 0.5
+# Bump whenever the look of the plots changes, so cached thumbnails (thumbnail_cache.py) are re-rendered
+PLOT_STYLE_VERSION = 1
+
+
+def _visible_deselected(deselected_data, selected_x, selected_y):
+    """
+    Deselected points to draw, as arrays. The 0/0 anchor is never drawn as deselected;
+    the P50 anchor only when 0/0 is part of the selection.
+    """
+    x = np.asarray(deselected_data["Insp. O2 (%)"], dtype=float)
+    y = np.asarray(deselected_data["SpO2 (%)"], dtype=float)
+    labels = np.asarray(deselected_data["Measurement Nr"])
+
+    # Compared with a tolerance since Insp. O2 is stored as float32
+    is_zero = np.isclose(x, ANCHOR_POINTS[0, 0]) & np.isclose(y, ANCHOR_POINTS[0, 1])
+    is_p50 = np.isclose(x, ANCHOR_POINTS[1, 0]) & np.isclose(y, ANCHOR_POINTS[1, 1])
+    zero_selected = bool(np.any((np.asarray(selected_x) == 0) & (np.asarray(selected_y) == 0)))
+    keep = ~is_zero & (~is_p50 | zero_selected)
+    return x[keep], y[keep], labels[keep]
+
+
+def _draw_points(ax, x, y, labels, color, legend_label, **style):
+    # One scatter call per point class; the number labels are added in one pass
+    if len(x) == 0:
+        return
+    ax.scatter(x, y, color=color, label=legend_label, **style)
+    if labels is not None:
+        for xi, yi, label in zip(x, y, labels):
+            ax.text(xi, yi + LABEL_OFFSET, f"{label}", fontsize=10, ha="center", color=color, fontweight="bold")
+
+
+def plot_fit(x_selected, y_selected, x_range, y_fitted, title, curve_label, deselected_data=None, measurement_numbers_selected=None):
+    """
+    Figure with the selected points (blue), the deselected points (grey) and the fitted curve (red).
+
+    The figure is built with the object-oriented Figure API, so it is not registered with pyplot:
+    it holds no global state and is freed as soon as the caller drops it, no plt.close needed.
+    """
+    fig = Figure()
+    ax = fig.subplots()
+
+    _draw_points(ax, x_selected, y_selected, measurement_numbers_selected, "blue", "Selected Data")
+    if deselected_data is not None:
+        x, y, labels = _visible_deselected(deselected_data, x_selected, y_selected)
+        _draw_points(ax, x, y, labels, "grey", "Deselected Data", alpha=0.6)
+
+    ax.plot(x_range, y_fitted, color="red", label=curve_label)
+    ax.set_title(title)
+    ax.set_xlabel("Insp. O2 (%)")
+    ax.set_ylabel("SpO2 (%)")
+    ax.legend()
+    return fig
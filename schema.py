@@ -0,0 +1,62 @@
+import pandas as pd
+
+# Column types applied once when the data is loaded; columns not listed here are kept as they come
+SCHEMA = {
+    "Patient_ID": "int32",
+    "Insp. O2 (%)": "float32",
+    "SpO2 (%)": "float32",
+    "selected_measurement": "uint8",
+    "is_ideal": "uint8",
+    "is_processed": "uint8",
+    "is_problematic": "uint8",
+    "comment": "string",
+}
+FLAG_COLUMNS = ["selected_measurement", "is_ideal", "is_processed", "is_problematic"]
+
+
+def _invalid(raw, numeric):
+    # Values that were filled in but are not numbers (empty cells are not errors)
+    filled = raw.notna() & (raw.astype(str).str.strip() != "")
+    return int((filled & numeric.isna()).sum())
+
+
+def apply_schema(data):
+    """
+    Cast `data` to SCHEMA and return (data, report). The report has the memory use before and
+    after in bytes and a list of validation messages: rows without a numeric Patient_ID are dropped,
+    other non-numeric measurements become NaN and unreadable flags become 0.
+    """
+    report = {"memory_before": int(data.memory_usage(deep=True).sum()), "errors": []}
+
+    patient_ids = pd.to_numeric(data["Patient_ID"], errors="coerce")
+    missing = int(patient_ids.isna().sum())
+    if missing:
+        report["errors"].append(f"{missing} row(s) without a numeric Patient_ID were skipped")
+    data = data[patient_ids.notna()].copy()
+    data["Patient_ID"] = patient_ids[patient_ids.notna()]
+
+    columns = {}
+    for column, dtype in SCHEMA.items():
+        if column not in data.columns:
+            report["errors"].append(f"Column {column} is missing")
+            continue
+        raw = data[column]
+        if dtype == "string":
+            columns[column] = raw.fillna("").astype(str).astype("string")
+            continue
+
+        numeric = pd.to_numeric(raw, errors="coerce")
+        invalid = _invalid(raw, numeric)
+        if column in FLAG_COLUMNS:
+            numeric = numeric.fillna(0)
+            out_of_range = int((~numeric.isin([0, 1])).sum())
+            if invalid or out_of_range:
+                report["errors"].append(f"{invalid + out_of_range} value(s) in {column} are not 0 or 1 and were read as 0")
+            numeric = numeric.where(numeric.isin([0, 1]), 0)
+        elif invalid:
+            report["errors"].append(f"{invalid} value(s) in {column} are not numbers")
+        columns[column] = numeric.astype(dtype)
+
+    data = data.assign(**columns)
+    report["memory_after"] = int(data.memory_usage(deep=True).sum())
+    return data, report
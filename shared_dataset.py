@@ -0,0 +1,55 @@
+import threading
+import uuid
+import numpy as np
+
+LABEL_COLUMNS = ["is_ideal", "is_processed", "is_problematic", "comment"]
+
+
+class SharedDataset:
+    """
+    The loaded measurements and their PatientIndex, held once per server process and shared by
+    every session. Sessions read `data` but never modify it; label changes go through apply_labels,
+    which updates the data under a lock and bumps `version`, so other sessions can tell they are
+    looking at changed patients on their next rerun.
+    """
+
+    def __init__(self, data, patient_ids, patient_index, load_report=None):
+        self.data = data
+        self.patient_ids = patient_ids
+        self.patient_index = patient_index
+        self.load_report = load_report
+        # Versions start over with every load; load_id tells loads apart, e.g. in cache keys
+        self.load_id = uuid.uuid4().hex
+        self.version = 0
+        self._changes = []  # (version, patient_id, source) per applied change
+        self._lock = threading.RLock()
+
+    def apply_labels(self, labels, source=None):
+        """Apply a patient's saved labels to the shared data and index; returns the new version."""
+        with self._lock:
+            patient_id = int(labels["patient_id"])
+            start, stop = self.patient_index.span(patient_id)
+            rows = slice(start, stop)
+
+            # Cast first: pandas won't set a plain list into the typed (uint8) column
+            selected = np.asarray(labels["selected_measurement"], dtype=self.data["selected_measurement"].dtype)
+            self.data.loc[labels["row_ids"], "selected_measurement"] = selected
+            for column in LABEL_COLUMNS:
+                self.data.iloc[rows, self.data.columns.get_loc(column)] = labels[column]
+
+            self.patient_index.update(
+                patient_id,
+                is_ideal=bool(labels["is_ideal"]),
+                is_processed=bool(labels["is_processed"]),
+                is_problematic=bool(labels["is_problematic"]),
+                comment=labels["comment"],
+            )
+
+            self.version += 1
+            self._changes.append((self.version, patient_id, source))
+            return self.version
+
+    def changes_since(self, version, source=None):
+        """IDs of patients changed after `version` by anyone other than `source`."""
+        with self._lock:
+            return sorted({pid for v, pid, s in self._changes if v > version and (source is None or s != source)})
@@ -0,0 +1,52 @@
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from gspread.utils import numericise_all
+from atomic_file import atomic_write
+
+# Local columnar copies of downloaded sheets, so new sessions don't have to download the whole sheet again
+SNAPSHOT_DIR = ".snapshot"
+
+
+def _paths(sheet_name):
+    base = os.path.join(SNAPSHOT_DIR, sheet_name)
+    return base + ".arrow", base + ".json"
+
+
+def read_snapshot(sheet_name, modified_time):
+    """
+    Return the snapshot of `sheet_name` if it was taken at the sheet's current `modified_time`, else None.
+    The Arrow file is memory-mapped rather than read into a buffer first.
+    """
+    data_path, meta_path = _paths(sheet_name)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, encoding="utf-8") as meta_file:
+        meta = json.load(meta_file)
+    if meta.get("modified_time") != modified_time:
+        return None
+
+    data = feather.read_table(data_path, memory_map=True).to_pandas()
+    # Columns with mixed values were stored as text; convert them back the way get_all_records does
+    for column in meta["text_columns"]:
+        data[column] = pd.Series(numericise_all(data[column].tolist()), index=data.index, dtype=object)
+    return data
+
+
+def write_snapshot(sheet_name, data, modified_time):
+    data_path, meta_path = _paths(sheet_name)
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+    # Arrow needs one type per column, so mixed (object) columns are stored as text
+    text_columns = [column for column in data.columns if data[column].dtype == object]
+    table = pa.Table.from_pandas(
+        data.astype({column: str for column in text_columns}),
+        preserve_index=False,
+    )
+
+    with atomic_write(data_path, "wb") as data_file:
+        feather.write_feather(table, data_file, compression="uncompressed")
+    with atomic_write(meta_path, encoding="utf-8") as meta_file:
+        json.dump({"modified_time": modified_time, "rows": len(data), "text_columns": text_columns}, meta_file)
@@ -1,39 +1,104 @@
+import logging
 import numpy as np
-import streamlit as st
 from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
+from fit_cache import fit_cache
+from plotting import plot_fit
+from tracing import span, traced
+
+logger = logging.getLogger(__name__)
 
 # Define the sigmoid function
 def sigmoid(x, L, x0, k, b):
     y = L / (1 + np.exp(-k * (x - x0))) + b
     return y
 
-# Function to train the sigmoid model
-def train_sigmoid_model(x_data, y_data):
-    # Initial guess:
-    #   L ~ (max(y) - min(y)), 
-    #   x0 ~ mean(x),
-    #   k ~ 0.1,
-    #   b ~ min(y)
-    p0 = [max(y_data) - min(y_data), np.mean(x_data), 0.1, min(y_data)]
-    
-    # Bounds: L in [0, 100], b in [0, 100], 
-    # x0 unbounded, k >= 0
-    # (Adjust as suits your data range.)
-    bounds = (
-        [0.0,       -np.inf,  0.0, 0.0],   # lower
-        [100.0,      np.inf,  np.inf, 100.0]  # upper
-    )
-    
-    popt, pcov = curve_fit(
-        sigmoid, 
-        x_data, 
-        y_data, 
-        p0=p0, 
-        method='trf', 
-        bounds=bounds
+# Bounds: L in [0, 100], b in [0, 100],
+# x0 unbounded, k >= 0
+# (Adjust as suits your data range.)
+SIGMOID_BOUNDS = (
+    [0.0,       -np.inf,  0.0, 0.0],   # lower
+    [100.0,      np.inf,  np.inf, 100.0]  # upper
+)
+
+# Closed-form Jacobian of the sigmoid with respect to (L, x0, k, b)
+def sigmoid_jacobian(x, L, x0, k, b):
+    x = np.asarray(x, dtype=float)
+    with np.errstate(over="ignore"):
+        s = 1 / (1 + np.exp(-k * (x - x0)))
+    slope = s * (1 - s)
+    return np.column_stack([s, -L * k * slope, L * (x - x0) * slope, np.ones_like(x)])
+
+# Initial guess from the linearized sigmoid: logit((y - b) / L) = k*x - k*x0
+def sigmoid_initial_guess(x_data, y_data):
+    x = np.asarray(x_data, dtype=float)
+    y = np.asarray(y_data, dtype=float)
+
+    # Crude guess, used where the linearization doesn't give a usable slope:
+    #   L ~ (max(y) - min(y)), x0 ~ mean(x), k ~ 0.1, b ~ min(y)
+    p0 = [max(y) - min(y), np.mean(x), 0.1, min(y)]
+
+    # Widen the range a little so every point maps strictly inside (0, 1)
+    span = max(y) - min(y)
+    b = max(min(y) - 0.05 * span, 0.0)
+    L = min(max(y) + 0.05 * span - b, 100.0)
+    if span > 0 and len(np.unique(x)) >= 2:
+        fraction = np.clip((y - b) / L, 1e-3, 1 - 1e-3)
+        k, intercept = np.polyfit(x, np.log(fraction / (1 - fraction)), 1)
+        if k > 0:
+            p0 = [L, -intercept / k, k, b]
+
+    lower, upper = SIGMOID_BOUNDS
+    return np.clip(p0, lower, upper)
+
+# Function to train the sigmoid model, reusing a cached fit when the selected points haven't changed.
+# With return_info=True the fit statistics (function/Jacobian evaluations, starting point) are returned too.
+# A given p0 (e.g. the patient's previous parameters) is tried first; if that fit fails it starts over from the usual initial guess.
+@traced()
+def train_sigmoid_model(x_data, y_data, return_info=False, p0=None):
+    result = None
+    if p0 is not None:
+        try:
+            result = _cached_sigmoid_fit(x_data, y_data, np.clip(p0, *SIGMOID_BOUNDS), warm_start=True)
+        except Exception:
+            result = None
+    if result is None:
+        result = _cached_sigmoid_fit(x_data, y_data, sigmoid_initial_guess(x_data, y_data), warm_start=False)
+    popt, info = result
+    return (popt, info) if return_info else popt
+
+def _cached_sigmoid_fit(x_data, y_data, p0, warm_start):
+    (popt, info), cached = fit_cache.get_or_fit(
+        "sigmoid",
+        x_data,
+        y_data,
+        (tuple(p0), SIGMOID_BOUNDS),
+        lambda: _fit_sigmoid_model(x_data, y_data, p0),
     )
-    return popt
+    info.update(cached=cached, warm_start=warm_start)
+    return popt, info
+
+def _fit_sigmoid_model(x_data, y_data, p0):
+    counts = {"nfev": 0, "njev": 0}
+
+    def model(x, *params):
+        counts["nfev"] += 1
+        return sigmoid(x, *params)
+
+    def jacobian(x, *params):
+        counts["njev"] += 1
+        return sigmoid_jacobian(x, *params)
+
+    with span("curve_fit", model="sigmoid", points=len(x_data)):
+        popt, pcov = curve_fit(
+            model,
+            x_data,
+            y_data,
+            p0=p0,
+            jac=jacobian,
+            method='trf',
+            bounds=SIGMOID_BOUNDS
+        )
+    return popt, {"nfev": counts["nfev"], "njev": counts["njev"], "p0": np.asarray(p0).tolist()}
 
 
 # Function to generate sigmoid curve and calculate MSE
@@ -47,48 +112,23 @@ def generate_sigmoid_fit(x_data, y_data, popt):
     mse = np.mean((y_data - y_pred) ** 2)
     return x_range, y_fitted, mse
 
+@traced()
 def plot_sigmoid_fit(x_selected, y_selected, popt, deselected_data=None, measurement_numbers_selected=None):
     try:
         x_range, y_fitted, mse = generate_sigmoid_fit(x_selected, y_selected, popt)
     except Exception as e:
-        st.error(f"Error generating Sigmoid fit: {e}")
+        logger.warning("Error generating Sigmoid fit: %s", e)
         return None, None
 
-    fig, ax = plt.subplots()
-
-    selected_points = set(zip(x_selected, y_selected))
-
-    # Plot selected data points with labels
-    if measurement_numbers_selected is not None:
-        for i, (x, y, label) in enumerate(zip(x_selected, y_selected, measurement_numbers_selected)):
-            ax.scatter(x, y, color="blue", label="Selected Data" if i == 0 else "")
-            ax.text(x, y + 0.5, f"{label}", fontsize=10, ha="center", color="blue", fontweight="bold")
-    else:
-        ax.scatter(x_selected, y_selected, color="blue", label="Selected Data")
-
-    # Plot deselected data points if provided
-    if deselected_data is not None:
-        for i, (x, y, label) in enumerate(zip(
-            deselected_data["Insp. O2 (%)"], 
-            deselected_data["SpO2 (%)"], 
-            deselected_data["Measurement Nr"]
-        )):
-            # Skip specific points (0,0) and (9.7,50) if they are deselected
-            if (x, y) == (0, 0):
-                continue
-            if (x, y) == (9.7, 50) and (0, 0) in selected_points:
-                pass  # Show as deselected
-            elif (x, y) in [(9.7, 50), (0, 0)]:
-                continue
-            ax.scatter(x, y, color="grey", label="Deselected Data" if i == 0 else "", alpha=0.6)
-            ax.text(x, y + 0.5, f"{label}", fontsize=10, ha="center", color="grey", fontweight="bold")
-
-    # Plot the fitted sigmoid curve
-    ax.plot(x_range, y_fitted, color="red", label="Fitted Sigmoid")
-    ax.set_title(f"Sigmoid Fit (MSE: {mse:.4f})")
-    ax.set_xlabel("Insp. O2 (%)")
-    ax.set_ylabel("SpO2 (%)")
-    ax.legend()
-    
+    fig = plot_fit(
+        x_selected,
+        y_selected,
+        x_range,
+        y_fitted,
+        f"Sigmoid Fit (MSE: {mse:.4f})",
+        "Fitted Sigmoid",
+        deselected_data=deselected_data,
+        measurement_numbers_selected=measurement_numbers_selected,
+    )
     return fig, mse
 
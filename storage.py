@@ -0,0 +1,207 @@
+import argparse
+import os
+import sqlite3
+import time
+import tomllib
+from abc import ABC, abstractmethod
+from contextlib import closing
+import pandas as pd
+from google_sheets import get_sheets_manager
+from sheet_snapshot import read_snapshot, write_snapshot
+from tracing import traced
+
+SHEET_NAME = "anonymized_219"
+
+# Status columns written to the first row of a patient, with their column numbers in the sheet
+SHEET_COLUMNS = {"selected_measurement": 5, "is_ideal": 7, "is_processed": 8, "is_problematic": 9, "comment": 10}
+LABEL_COLUMNS = ["is_ideal", "is_processed", "is_problematic", "comment"]
+
+
+class StorageBackend(ABC):
+    """
+    Persistence used by data_connector. Rows are identified by their row id, the index of the
+    frame returned by load_all (for the Google Sheet: the sheet row minus the header offset).
+
+    `labels` passed to write_patient_labels is a dict with patient_id, row_ids, selected_measurement
+    (one value per row id) and the patient's is_ideal, is_processed, is_problematic and comment,
+    which are stored on the patient's first row.
+    """
+
+    # Short description of where the last load_all came from, for the startup report
+    last_load_source = None
+
+    @abstractmethod
+    def load_all(self):
+        pass
+
+    @abstractmethod
+    def load_patient(self, patient_id):
+        pass
+
+    @abstractmethod
+    def list_patients(self):
+        pass
+
+    @abstractmethod
+    def write_patient_labels(self, labels):
+        pass
+
+
+def build_sheet_updates(labels):
+    # Rows in the Google Sheet (1-based index, with header)
+    patient_rows = [row_id + 2 for row_id in labels["row_ids"]]
+
+    # Update "selected_measurement" for each measurement of the patient
+    updates = [
+        (row, SHEET_COLUMNS["selected_measurement"], selected)
+        for row, selected in zip(patient_rows, labels["selected_measurement"])
+    ]
+    # Update "is_ideal", "is_processed", "is_problematic" and the comment (only for the first row of this patient in Google Sheets)
+    for column in LABEL_COLUMNS:
+        updates.append((patient_rows[0], SHEET_COLUMNS[column], labels[column]))
+    return updates
+
+
+class GoogleSheetsStorage(StorageBackend):
+    def __init__(self, secrets, sheet_name=SHEET_NAME):
+        self.sheet_manager = get_sheets_manager(secrets)
+        self.sheet_name = sheet_name
+
+    @traced("sheets.load_all")
+    def load_all(self):
+        # Use the local snapshot while the sheet is unchanged, download it again otherwise
+        modified_time = self.sheet_manager.get_modified_time(self.sheet_name)
+        data = read_snapshot(self.sheet_name, modified_time)
+        self.last_load_source = "local snapshot"
+        if data is None:
+            sheet = self.sheet_manager.get_sheet(self.sheet_name)
+            data = pd.DataFrame(sheet.get_all_records())
+            write_snapshot(self.sheet_name, data, modified_time)
+            self.last_load_source = "Google Sheet"
+        return data
+
+    def load_patient(self, patient_id):
+        # The sheet can't be queried by patient, so this goes through the (snapshot-backed) full load
+        data = self.load_all()
+        return data[data["Patient_ID"] == patient_id]
+
+    def list_patients(self):
+        return self.load_all()["Patient_ID"].unique()
+
+    @traced("sheets.write_patient_labels")
+    def write_patient_labels(self, labels):
+        sheet = self.sheet_manager.get_sheet(self.sheet_name)
+        return self.sheet_manager.update_multiple_cells(sheet, build_sheet_updates(labels))
+
+
+class SqliteStorage(StorageBackend):
+    """
+    Local SQLite copy of the measurements, one table row per sheet row, indexed on Patient_ID
+    and on the status flags. Every write of a patient runs in a single transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        # A connection per call keeps the backend usable from the script threads and the write-behind thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    @classmethod
+    def create(cls, path, data):
+        """Create (or replace) the database at `path` from a frame shaped like GoogleSheetsStorage.load_all()."""
+        # Remove the side files too: SQLite would pair a leftover WAL with the new database
+        for suffix in ["", "-wal", "-shm", "-journal"]:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        storage = cls(path)
+        with closing(storage._connect()) as connection:
+            # The connection context manager only commits; closing() closes the connection
+            with connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                # Written without pandas' own index on row_id; the unique index below is the only one on it
+                data.rename_axis("row_id").reset_index().to_sql("measurements", connection, index=False)
+                connection.execute('CREATE UNIQUE INDEX idx_row_id ON measurements ("row_id")')
+                connection.execute('CREATE INDEX idx_patient ON measurements ("Patient_ID")')
+                for column in ["is_ideal", "is_processed", "is_problematic"]:
+                    connection.execute(f'CREATE INDEX idx_{column} ON measurements ("{column}")')
+        return storage
+
+    def _query(self, sql, params=()):
+        with closing(self._connect()) as connection:
+            data = pd.read_sql_query(sql, connection, params=params, index_col="row_id")
+        data.index.name = None
+        return data
+
+    @traced("sqlite.load_all")
+    def load_all(self):
+        self.last_load_source = "SQLite database"
+        return self._query("SELECT * FROM measurements ORDER BY row_id")
+
+    def load_patient(self, patient_id):
+        return self._query('SELECT * FROM measurements WHERE "Patient_ID" = ? ORDER BY row_id', (int(patient_id),))
+
+    def list_patients(self):
+        with closing(self._connect()) as connection:
+            rows = connection.execute('SELECT DISTINCT "Patient_ID" FROM measurements ORDER BY "Patient_ID"').fetchall()
+        return [row[0] for row in rows]
+
+    @traced("sqlite.write_patient_labels")
+    def write_patient_labels(self, labels):
+        started = time.perf_counter()
+        connection = self._connect()
+        try:
+            # The connection context manager commits on success and rolls back on any error
+            with connection:
+                connection.executemany(
+                    'UPDATE measurements SET "selected_measurement" = ? WHERE row_id = ?',
+                    zip(labels["selected_measurement"], labels["row_ids"]),
+                )
+                connection.execute(
+                    'UPDATE measurements SET "is_ideal" = ?, "is_processed" = ?, "is_problematic" = ?, "comment" = ? WHERE row_id = ?',
+                    [labels[column] for column in LABEL_COLUMNS] + [labels["row_ids"][0]],
+                )
+        finally:
+            connection.close()
+        return {
+            "cells": len(labels["row_ids"]) + len(LABEL_COLUMNS),
+            "ranges": 2,
+            "requests": 1,
+            "latency": time.perf_counter() - started,
+        }
+
+
+def create_storage(config, secrets):
+    """Backend from the [storage] config section: backend = "gsheets" (default) or "sqlite" with a path."""
+    if config.get("backend", "gsheets") == "sqlite":
+        return SqliteStorage(config.get("path", "measurements.sqlite"))
+    return GoogleSheetsStorage(secrets)
+
+
+def load_secrets(path=os.path.join(".streamlit", "secrets.toml")):
+    """The Streamlit secrets file as a dict, for command-line tools running outside Streamlit."""
+    with open(path, "rb") as secrets_file:
+        return tomllib.load(secrets_file)
+
+
+def storage_from_secrets(secrets):
+    """The backend configured in a secrets dict, as data_connector.get_storage() would create it."""
+    return create_storage(secrets.get("storage", {}), secrets.get("connections", {}).get("gsheets", {}))
+
+
+def migrate_sheet_to_sqlite(secrets, path, sheet_name=SHEET_NAME):
+    """One-shot copy of the sheet into a new SQLite database at `path`."""
+    data = GoogleSheetsStorage(secrets, sheet_name).load_all()
+    SqliteStorage.create(path, data)
+    return len(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy the measurements sheet into a SQLite database.")
+    parser.add_argument("path", help="SQLite database file to create")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"), help="Streamlit secrets file with the gsheets connection")
+    args = parser.parse_args()
+
+    secrets = load_secrets(args.secrets)["connections"]["gsheets"]
+    rows = migrate_sheet_to_sqlite(secrets, args.path)
+    print(f"Copied {rows} rows to {args.path}")
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+import numpy as np
+from atomic_file import atomic_write
+
+THUMBNAIL_DIR = ".thumbnails"
+# Oldest thumbnails are evicted once the cache grows past this size
+MAX_BYTES = 256 * 1024 * 1024
+# Stored with the PNG so a hit can show the caption without refitting
+METADATA_KEY = "measurement_picker"
+
+
+def png_metadata(values):
+    # Passed to savefig(metadata=...), which writes it as a PNG text chunk
+    return {METADATA_KEY: json.dumps(values)}
+
+
+def read_png_metadata(png):
+    """The values written with png_metadata, read back from the PNG text chunks (None if missing)."""
+    position = 8  # PNG signature
+    while position + 8 <= len(png):
+        length, chunk_type = struct.unpack(">I4s", png[position:position + 8])
+        if chunk_type == b"tEXt":
+            keyword, _, text = png[position + 8:position + 8 + length].partition(b"\0")
+            if keyword.decode("latin-1") == METADATA_KEY:
+                return json.loads(text.decode("latin-1"))
+        if chunk_type == b"IEND":
+            break
+        # length, type, data and CRC
+        position += 12 + length
+    return None
+
+
+# Content-addressed cache of rendered plots on local disk, shared by every session and process on the machine.
+# Thumbnails are stored as <directory>/<patient_id>/<key>.png; the key hashes everything the plot is drawn from,
+# so a changed selection, new parameters or a new plot style simply miss, and stale files age out.
+class ThumbnailCache:
+    def __init__(self, directory=THUMBNAIL_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(patient_id, model_name, arrays, params, style_version):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((patient_id, model_name, style_version)).encode())
+        for values in arrays:
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            digest.update(len(values).to_bytes(8, "little"))
+            digest.update(values.tobytes())
+        # Parameters are only known up front when they come from the batch fit; otherwise the points determine them
+        digest.update(b"fit" if params is None else np.asarray(params, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def _patient_dir(self, patient_id):
+        return os.path.join(self.directory, str(patient_id))
+
+    def _path(self, patient_id, key):
+        return os.path.join(self._patient_dir(patient_id), f"{key}.png")
+
+    def get(self, patient_id, key):
+        """PNG bytes of a cached thumbnail, or None."""
+        path = self._path(patient_id, key)
+        try:
+            with open(path, "rb") as thumbnail:
+                png = thumbnail.read()
+            # Eviction goes by modification time, so a hit marks the file as recently used
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return png
+
+    def put(self, patient_id, key, png):
+        path = self._path(patient_id, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path, "wb") as thumbnail:
+            thumbnail.write(png)
+        with self._lock:
+            if self._size is not None:
+                self._size += len(png)
+            if self._current_size() > self.max_bytes:
+                self._evict()
+
+    def invalidate_patient(self, patient_id):
+        # Drop every thumbnail of a patient, e.g. after their selection was saved
+        with self._lock:
+            shutil.rmtree(self._patient_dir(patient_id), ignore_errors=True)
+            self._size = None
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for patient_dir in os.scandir(self.directory):
+            if not patient_dir.is_dir():
+                continue
+            for entry in os.scandir(patient_dir.path):
+                if entry.name.endswith(".png"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _current_size(self):
+        # Scanned once, then kept up to date by put(); other processes' writes are picked up on the next eviction
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def _evict(self):
+        # Remove the least recently used thumbnails until the cache is back to 90% of its limit
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._current_size(), "max_bytes": self.max_bytes}
+
+
+thumbnail_cache = ThumbnailCache()
@@ -0,0 +1,114 @@
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+# Tracing is off unless MEASUREMENT_PICKER_TRACE=1; spans are then shown per rerun and appended to TRACE_PATH
+ENABLED = os.environ.get("MEASUREMENT_PICKER_TRACE", "") == "1"
+TRACE_PATH = os.environ.get("MEASUREMENT_PICKER_TRACE_FILE", os.path.join(".trace", "spans.jsonl"))
+
+_local = threading.local()
+_file_lock = threading.Lock()
+_disabled_span = nullcontext()
+
+
+def _write(record):
+    with _file_lock:
+        os.makedirs(os.path.dirname(TRACE_PATH) or ".", exist_ok=True)
+        with open(TRACE_PATH, "a", encoding="utf-8") as trace_file:
+            trace_file.write(json.dumps(record) + "\n")
+
+
+@contextmanager
+def _span(name, attributes):
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    record = {
+        "name": name,
+        "session": getattr(_local, "session", None),
+        "rerun": getattr(_local, "rerun", None),
+        "thread": threading.current_thread().name,
+        "parent": stack[-1]["name"] if stack else None,
+        "depth": len(stack),
+        "start": time.time(),
+        **({"attributes": attributes} if attributes else {}),
+    }
+    stack.append(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["ms"] = (time.perf_counter() - started) * 1000
+        stack.pop()
+        spans = getattr(_local, "spans", None)
+        if spans is not None:
+            spans.append(record)
+        _write(record)
+
+
+def span(name, **attributes):
+    """Time the enclosed block as `name`; a shared no-op context when tracing is disabled."""
+    if not ENABLED:
+        return _disabled_span
+    return _span(name, attributes)
+
+
+def traced(name=None):
+    """Decorator version of span, named after the function unless `name` is given."""
+    def decorate(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with _span(span_name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def begin_rerun():
+    # Spans of this script thread from here on make up the current rerun's breakdown
+    if not ENABLED:
+        return
+    # Imported here so the fitting code can use tracing without Streamlit installed
+    import streamlit as st
+    _local.session = st.session_state.setdefault("trace_session", uuid.uuid4().hex)
+    _local.rerun = uuid.uuid4().hex
+    _local.spans = []
+    _local.rerun_started = time.perf_counter()
+
+
+def render_timing_panel():
+    """Collapsible breakdown of the spans recorded since begin_rerun()."""
+    spans = getattr(_local, "spans", None) if ENABLED else None
+    if spans is None:
+        return
+    import streamlit as st
+    total_ms = (time.perf_counter() - _local.rerun_started) * 1000
+    with st.expander(f"⏱️ Rerun timing: {total_ms:.0f} ms"):
+        if not spans:
+            st.caption("No spans recorded in this rerun.")
+            return
+        # Spans finish innermost first; sort by start time to show them as a tree
+        rows = sorted(spans, key=lambda record: record["start"])
+        st.dataframe(
+            pd.DataFrame({
+                "span": ["\u2003" * record["depth"] + record["name"] for record in rows],
+                "ms": [record["ms"] for record in rows],
+                "% of rerun": [100 * record["ms"] / total_ms for record in rows],
+            }),
+            hide_index=True,
+            column_config={
+                "ms": st.column_config.NumberColumn(format="%.1f"),
+                "% of rerun": st.column_config.NumberColumn(format="%.0f%%"),
+            },
+        )
+    _local.spans = None
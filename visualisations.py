@@ -2,6 +2,8 @@ import pandas as pd
 import streamlit as st
 from sigmoid import train_sigmoid_model, plot_sigmoid_fit
 from hill_equation import train_hill_model, plot_hill_fit
+from fit_cache import fit_cache
+from tracing import span
 
 
 def button_models(patient_data, updated_table):
@@ -12,6 +14,36 @@ def button_models(patient_data, updated_table):
     with col2:
         button_hill_model(patient_data, updated_table)
 
+    cache_stats = fit_cache.stats()
+    st.caption(f"Fit cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['size']}/{cache_stats['maxsize']} entries")
+
+def fit_info_text(fit_info):
+    source = "cached fit" if fit_info["cached"] else "fitted"
+    start = "warm start from the previous fit" if fit_info.get("warm_start") else "cold start"
+    return f"{source} ({start}): {fit_info['njev']} iterations, {fit_info['nfev']} function evaluations"
+
+# After changing at most this many "Include in model" checkboxes, a refit starts from the patient's previous parameters
+WARM_START_MAX_CHANGES = 2
+
+def warm_start_p0(model_name, patient_data, selection):
+    # Last fitted parameters of this patient and model, if the selection changed only a little since then
+    previous = st.session_state.get("last_fits", {}).get((model_name, int(patient_data["Patient_ID"].iloc[0])))
+    if previous is None:
+        return None
+    popt, previous_selection, previous_p0 = previous
+    if len(previous_selection) != len(selection):
+        return None
+    changes = sum(before != after for before, after in zip(previous_selection, selection))
+    if changes == 0:
+        # The same start as last time, so the fit cache key matches and the fit is a lookup
+        return previous_p0
+    return popt if changes <= WARM_START_MAX_CHANGES else None
+
+def remember_fit(model_name, patient_data, selection, popt, p0, fit_info):
+    # Keeps the start the fit was made from (None: the cold initial guess) next to its parameters
+    last_fits = st.session_state.setdefault("last_fits", {})
+    last_fits[(model_name, int(patient_data["Patient_ID"].iloc[0]))] = (list(popt), selection, p0 if fit_info["warm_start"] else None)
+
 def button_sigmoid_model(patient_data, updated_table):
     # Filter selected and deselected data
     
@@ -24,11 +56,20 @@ def button_sigmoid_model(patient_data, updated_table):
         measurement_numbers_selected = selected_data["Measurement Nr"].values
 
         try:
-            popt = train_sigmoid_model(x_selected, y_selected)
+            selection = updated_table["Include in model"].tolist()
+            p0 = warm_start_p0("sigmoid", patient_data, selection)
+            popt, fit_info = train_sigmoid_model(x_selected, y_selected, return_info=True, p0=p0)
+            if popt is not None:
+                remember_fit("sigmoid", patient_data, selection, popt, p0, fit_info)
             fig, mse = plot_sigmoid_fit(x_selected, y_selected, popt, deselected_data, measurement_numbers_selected)
-            
-            st.pyplot(fig)
+            if fig is None:
+                st.error("Error generating Sigmoid fit.")
+                return
+
+            with span("st.pyplot"):
+                st.pyplot(fig)
             st.write(f"Sigmoid Mean Squared Error (MSE): {mse:.4f}")
+            st.caption(fit_info_text(fit_info))
         except Exception as e:
             st.error(f"Error in fitting sigmoid model: {e}")
     else:
@@ -46,10 +87,21 @@ def button_hill_model(patient_data, updated_table):
         measurement_numbers_selected = selected_data["Measurement Nr"].values
 
         try:
-            popt = train_hill_model(x_selected, y_selected)
+            selection = updated_table["Include in model"].tolist()
+            p0 = warm_start_p0("hill", patient_data, selection)
+            popt, fit_info = train_hill_model(x_selected, y_selected, return_info=True, p0=p0)
+            if popt is None:
+                st.error(f"Error in curve fitting: {fit_info['error']}")
+                return
+            remember_fit("hill", patient_data, selection, popt, p0, fit_info)
             fig, mse = plot_hill_fit(x_selected, y_selected, popt, deselected_data, measurement_numbers_selected)
-            st.pyplot(fig)
+            if fig is None:
+                st.error("Error generating Hill fit.")
+                return
+            with span("st.pyplot"):
+                st.pyplot(fig)
             st.write(f" Hill Mean Squared Error (MSE): {mse:.4f}")
+            st.caption(fit_info_text(fit_info))
         except Exception as e:
             st.error(f"Error in fitting sigmoid model: {e}")
     else:
@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from atomic_file import atomic_write
+
+# Failed writes are retried after this many seconds
+RETRY_SECONDS = 5.0
+
+
+class WriteBehindQueue:
+    """
+    Write-behind queue for patient label saves.
+
+    Every save is appended to a local append-only journal (JSON lines) and handed to a background
+    thread that writes it to the sheet. Repeated saves for the same patient are coalesced, since each
+    save carries the patient's complete labels only the latest one is written. Journal records:
+
+        {"type": "save", "seq": 3, "labels": {...}}   a save waiting to be written
+        {"type": "done", "seqs": [1, 3]}               saves that reached the sheet
+
+    Saves without a "done" record are replayed when the process restarts. The journal is truncated
+    whenever nothing is pending.
+    """
+
+    def __init__(self, journal_path, write_labels, retry_seconds=RETRY_SECONDS):
+        self.journal_path = journal_path
+        self._write_labels = write_labels
+        self._retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = OrderedDict()  # seq -> labels
+        self._failed = {}  # patient_id -> error message of the last attempt
+        # Write stats (cells, requests, latency) of the latest write, and running totals since start-up
+        self._last_write = None
+        self._totals = {"writes": 0, "requests": 0, "latency": 0.0}
+        self._next_seq = 1
+
+        os.makedirs(os.path.dirname(journal_path) or ".", exist_ok=True)
+        self._replay()
+
+        self._thread = threading.Thread(target=self._run, name="sheet-write-behind", daemon=True)
+        self._thread.start()
+        if self._pending:
+            self._wake.set()
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-append can leave a truncated last line
+                    continue
+                if record["type"] == "save":
+                    self._pending[record["seq"]] = record["labels"]
+                    self._next_seq = max(self._next_seq, record["seq"] + 1)
+                elif record["type"] == "done":
+                    for seq in record["seqs"]:
+                        self._pending.pop(seq, None)
+        self._compact()
+
+    def _append(self, record):
+        with open(self.journal_path, "a", encoding="utf-8") as journal:
+            journal.write(json.dumps(record) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _compact(self):
+        # Rewrite the journal with only the saves that are still pending
+        with atomic_write(self.journal_path, encoding="utf-8", fsync=True) as journal:
+            for seq, labels in self._pending.items():
+                journal.write(json.dumps({"type": "save", "seq": seq, "labels": labels}) + "\n")
+
+    def enqueue(self, labels):
+        """Journal a patient's labels and schedule the write; returns immediately."""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._append({"type": "save", "seq": seq, "time": time.time(), "labels": labels})
+            self._pending[seq] = labels
+        self._wake.set()
+
+    def pending_labels(self):
+        """Latest pending labels per patient, e.g. to re-apply them to freshly loaded data."""
+        with self._lock:
+            return list(self._coalesce(self._pending).values())
+
+    def status(self):
+        with self._lock:
+            return {
+                "pending": len(self._coalesce(self._pending)),
+                "failed": dict(self._failed),
+                "last_write": dict(self._last_write) if self._last_write else None,
+                "totals": dict(self._totals),
+            }
+
+    @staticmethod
+    def _coalesce(pending):
+        latest = OrderedDict()
+        for labels in pending.values():
+            latest[labels["patient_id"]] = labels
+        return latest
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self._retry_seconds)
+            self._wake.clear()
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending = OrderedDict(self._pending)
+        if not pending:
+            return
+
+        for patient_id, labels in self._coalesce(pending).items():
+            seqs = [seq for seq, entry in pending.items() if entry["patient_id"] == patient_id]
+            try:
+                stats = self._write_labels(labels)
+            except Exception as e:
+                # Stays pending and is retried on the next wake-up
+                with self._lock:
+                    self._failed[patient_id] = str(e)
+                continue
+
+            with self._lock:
+                for seq in seqs:
+                    self._pending.pop(seq, None)
+                self._failed.pop(patient_id, None)
+                self._append({"type": "done", "seqs": seqs})
+                if stats:
+                    self._last_write = {"patient_id": patient_id, **stats}
+                    self._totals["writes"] += 1
+                    self._totals["requests"] += stats["requests"]
+                    self._totals["latency"] += stats["latency"]
+
+        with self._lock:
+            if not self._pending:
+                self._compact()